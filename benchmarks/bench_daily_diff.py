@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Compares the old per-region loop of daily differences in `process` with
+# the grouped `add_daily` on synthetic data: python3 benchmarks/bench_daily_diff.py
+
+import os
+import sys
+import timeit
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from process_procedures import add_daily
+
+
+def make_cases(n_regions, n_days=600):
+    dates = pd.date_range('2020-01-22', periods=n_days)
+    rng = np.random.default_rng(0)
+    cases = pd.DataFrame({
+        'Date': np.tile(dates, n_regions),
+        'Place': np.repeat(['Region %03d' % i for i in range(n_regions)], n_days),
+        'Confirmed': rng.integers(0, 1000, n_regions * n_days).cumsum(),
+        'Deaths': rng.integers(0, 10, n_regions * n_days).cumsum()})
+    return cases
+
+
+def loop_daily(cases):
+    for region in sorted(set(cases['Place'])):
+        cases.loc[cases['Place'] == region, 'Confirmed_daily'] = \
+            cases.loc[cases['Place'] == region, 'Confirmed'].diff()
+        cases.loc[cases['Place'] == region, 'Deaths_daily'] = \
+            cases.loc[cases['Place'] == region, 'Deaths'].diff()
+    cases['Confirmed_daily'] = cases['Confirmed_daily'].fillna(cases['Confirmed'])
+    cases['Deaths_daily'] = cases['Deaths_daily'].fillna(cases['Deaths'])
+    # add_daily keeps daily values in float32
+    cases[['Confirmed_daily', 'Deaths_daily']] = cases[['Confirmed_daily', 'Deaths_daily']].astype(np.float32)
+    return cases
+
+
+print('%8s %12s %12s %9s' % ('regions', 'loop, ms', 'grouped, ms', 'speedup'))
+for n_regions in [1, 10, 50, 100, 200]:
+    cases = make_cases(n_regions)
+    pd.testing.assert_frame_equal(loop_daily(cases.copy()), add_daily(cases.copy()))
+    repeat = 3
+    loop_time = timeit.timeit(lambda: loop_daily(cases.copy()), number=repeat) / repeat
+    grouped_time = timeit.timeit(lambda: add_daily(cases.copy()), number=repeat) / repeat
+    print('%8d %12.2f %12.2f %9.1f' % (n_regions, loop_time * 1e3, grouped_time * 1e3,
+                                       loop_time / grouped_time))
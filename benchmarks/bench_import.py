@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Reports import time and peak RSS of the plotting modules with and without
+# the neural forecast backends: python3 benchmarks/bench_import.py
+# With tensorflow 2.21 on one CPU it gave:
+# import                                 time, s    RSS, MB  tensorflow
+# process_procedures                        0.97      117.0          no
+# covid_web                                 1.12      126.1          no
+# process_procedures + cnn backend          4.62      624.9         yes
+
+import os
+import subprocess
+import sys
+
+repo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+measure = '''
+import resource, sys, time
+start = time.time()
+%s
+elapsed = time.time() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.)
+print(int('tensorflow' in sys.modules))
+'''
+
+cases = [('process_procedures', 'import process_procedures'),
+         ('covid_web', 'import covid_web'),
+         ('process_procedures + cnn backend',
+          'import process_procedures; process_procedures.neural_backend("cnn")')]
+
+print('%-35s %10s %10s %11s' % ('import', 'time, s', 'RSS, MB', 'tensorflow'))
+for name, statement in cases:
+    result = subprocess.run([sys.executable, '-c', measure % statement], cwd=repo_path,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        print('%-35s failed: %s' % (name, result.stderr.strip().splitlines()[-1]))
+        continue
+    lines = result.stdout.split('\n')
+    elapsed, rss = map(float, lines[-3].split())
+    print('%-35s %10.2f %10.1f %11s' % (name, elapsed, rss, 'yes' if lines[-2] == '1' else 'no'))
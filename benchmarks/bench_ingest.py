@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Reports time and peak RSS of parsing cases_time.csv with the old full
+# read_csv and with the chunked `parse_cases`:
+# python3 benchmarks/bench_ingest.py [COVID-19/data/cases_time.csv]
+# Without a file a synthetic one with the columns of the JHU file is written.
+
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+repo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+measure = '''
+import resource, sys, time
+sys.path.insert(0, %r)
+import numpy as np
+import pandas as pd
+from process_procedures import parse_cases
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.time()
+%s
+elapsed = time.time() - start
+print(elapsed, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024., len(cases))
+'''
+
+# the parse before chunked ingestion
+full_read = '''
+cases_raw = pd.read_csv(%r, low_memory=False)
+cases_raw = cases_raw[cases_raw['UID'] != 840]
+cases = pd.DataFrame(cases_raw[['Country_Region', 'Last_Update', 'Confirmed', 'Deaths']])
+cases.rename(columns={'Country_Region': 'Place', 'Last_Update': 'Date'}, inplace=True)
+cases['Date'] = pd.to_datetime(cases['Date']).dt.normalize()
+cases = cases.groupby(['Date', 'Place']).sum().reset_index()
+'''
+
+
+def make_cases_file(file_path, n_places=4000, n_days=600):
+    # provinces of 200 countries, as in the JHU file
+    dates = pd.date_range('2020-01-22', periods=n_days).strftime('%Y-%m-%d')
+    rng = np.random.default_rng(0)
+    n = n_places * n_days
+    pd.DataFrame({
+        'Country_Region': np.repeat(['Country %03d' % (i % 200) for i in range(n_places)], n_days),
+        'Last_Update': np.tile(dates, n_places),
+        'Confirmed': rng.integers(0, 1000, n),
+        'Deaths': rng.integers(0, 10, n),
+        'Recovered': rng.integers(0, 1000, n),
+        'Active': rng.integers(0, 1000, n),
+        'Delta_Confirmed': rng.integers(0, 100, n),
+        'Delta_Recovered': rng.integers(0, 100, n),
+        'Incident_Rate': rng.random(n),
+        'People_Tested': rng.integers(0, 10 ** 6, n),
+        'People_Hospitalized': rng.integers(0, 1000, n),
+        'Province_State': np.repeat(['Province %04d' % i for i in range(n_places)], n_days),
+        'FIPS': np.nan,
+        'UID': np.repeat(np.arange(n_places) + 1000, n_days),
+        'iso3': 'XXX',
+        'Report_Date_String': np.tile(dates, n_places)}).to_csv(file_path, index=False)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == '--make':
+        make_cases_file(sys.argv[2])
+        sys.exit(0)
+    if len(sys.argv) > 1:
+        cases_file = sys.argv[1]
+    else:
+        # written by a child process, forked measurements inherit peak RSS of this one
+        cases_file = os.path.join(tempfile.mkdtemp(), 'cases_time.csv')
+        subprocess.run([sys.executable, __file__, '--make', cases_file], check=True)
+    print('%s, %.1f MB' % (cases_file, os.path.getsize(cases_file) / 2 ** 20))
+
+    print('%-15s %10s %15s %10s' % ('ingest', 'time, s', 'peak RSS, MB', 'rows'))
+    for name, statement in [('full read_csv', full_read % cases_file),
+                            ('parse_cases', 'cases = parse_cases(%r)' % cases_file)]:
+        result = subprocess.run([sys.executable, '-c', measure % (repo_path, statement)],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            print('%-15s failed: %s' % (name, result.stderr.strip().splitlines()[-1]))
+            continue
+        elapsed, rss, rows = result.stdout.split()
+        print('%-15s %10.2f %15.1f %10s' % (name, float(elapsed), float(rss), rows))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Compares renders per second of the pyplot drawing of `process` and of the
+# Agg renderer of the web service on synthetic regions with forecasts:
+# python3 benchmarks/bench_render.py
+
+import io
+import os
+import sys
+import timeit
+from types import SimpleNamespace
+
+import matplotlib
+
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from process_procedures import draw_plot
+from plot_renderer import render_plot
+
+
+def make_regions(n_regions, n_days=400, n_forward=14):
+    dates = pd.date_range('2020-03-01', periods=n_days)
+    forward = pd.date_range(dates[-1], periods=n_forward + 1)[1:]
+    rng = np.random.default_rng(0)
+    region_cases, predictions, countries_params = {}, {}, {}
+    for i in range(n_regions):
+        region = 'Region %03d' % i
+        daily = rng.integers(0, 1000, n_days).astype(float)
+        region_cases[region] = pd.DataFrame({
+            'Date': dates, 'Place': region, 'Confirmed': daily.cumsum(), 'Deaths': (daily / 50).cumsum(),
+            'Confirmed_daily': daily, 'Deaths_daily': daily / 50})
+        for field_name in ['Confirmed', 'Deaths']:
+            last = region_cases[region][field_name].iloc[-1]
+            predictions[region, field_name] = pd.DataFrame(
+                {field_name: last + np.arange(1, n_forward + 1) * 500.}, index=forward)
+        countries_params[region] = {'country_ru': region}
+    return region_cases, predictions, countries_params
+
+
+args = SimpleNamespace(daily=True, deaths=True, forec_confirmed=['linear', '14', '14'],
+                       forec_deaths=['linear', '14', '14'], nonabs=False, from_date='2020-04-01',
+                       nonlog=False, forec_current_day=[])
+
+print('%8s %16s %16s %9s' % ('regions', 'pyplot, 1/s', 'renderer, 1/s', 'speedup'))
+for n_regions in [1, 5, 10, 20]:
+    region_cases, predictions, countries_params = make_regions(n_regions)
+    regions = sorted(region_cases)
+    populations = dict.fromkeys(regions, 1.)
+    repeat = 5
+    pyplot_time = timeit.timeit(lambda: draw_plot(args, regions, region_cases, populations, predictions,
+                                                  countries_params, io.BytesIO()),
+                                number=repeat) / repeat
+    renderer_time = timeit.timeit(lambda: render_plot(args, regions, region_cases, predictions,
+                                                      countries_params, io.BytesIO()),
+                                  number=repeat) / repeat
+    print('%8d %16.2f %16.2f %9.1f' % (n_regions, 1. / pyplot_time, 1. / renderer_time,
+                                       pyplot_time / renderer_time))
@@ -0,0 +1,77 @@
+import hashlib
+import os
+import threading
+
+from process_procedures import preprocess, prepare_tables
+from snapshot import current_path, load_current
+
+
+def source_signature(paths):
+    # cheap change detector: (path, mtime, size) of every source file
+    signature = []
+    for file_path in paths:
+        stat = os.stat(file_path)
+        signature.append((file_path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def signature_version(signature):
+    m = hashlib.md5()
+    m.update(repr(signature).encode('utf-8', 'backslashreplace'))
+    return m.hexdigest()[:16]
+
+
+class CasesCache:
+    """Process-wide store of preprocessed `cases`/`cases_today` frames.
+
+    With a snapshot the frames are read-only maps of its current version,
+    shared with the other processes, and are switched when a new version
+    is published (covid_plot.py updates it). Without one the CSV files are
+    parsed once and reloaded only when their mtime or size changes. `get`
+    returns the frames together with the data version string, which
+    changes on every reload. The frames are shared between requests and
+    must not be modified in place.
+    """
+
+    def __init__(self, covid_data_path, cases_file, cases_today_file, snapshot_path=None,
+                 countries_params=None):
+        self.covid_data_path = covid_data_path
+        self.cases_file = cases_file
+        self.cases_today_file = cases_today_file
+        self.snapshot_path = snapshot_path
+        self.countries_params = countries_params
+        self._lock = threading.Lock()
+        self._data = None
+        self.loads = 0
+
+    def source_paths(self):
+        return [os.path.join(self.covid_data_path, self.cases_file),
+                os.path.join(self.covid_data_path, self.cases_today_file)]
+
+    def version(self):
+        if self.snapshot_path is not None:
+            path = current_path(self.snapshot_path)
+            if path is not None:
+                return os.path.basename(path)
+        return signature_version(source_signature(self.source_paths()))
+
+    def load(self, version):
+        if self.snapshot_path is not None:
+            current = load_current(self.snapshot_path)
+            if current is not None:
+                return prepare_tables(current[1], current[2], self.countries_params) + (current[0],)
+        return preprocess(None, self.covid_data_path, self.cases_file, self.cases_today_file,
+                          countries_params=self.countries_params) + (version,)
+
+    def get(self):
+        version = self.version()
+        data = self._data
+        if data is not None and data[2] == version:
+            return data
+
+        with self._lock:
+            # another thread could reload the data while we were waiting
+            if self._data is None or self._data[2] != version:
+                self._data = self.load(version)
+                self.loads += 1
+            return self._data
@@ -2,18 +2,30 @@ import os
 import sys
 import pandas as pd
 import json
+from snapshot import snapshot_places
+from process_procedures import aggregate_places
 
 
 source_path = 'COVID-19/data'
 cases_time_file = 'cases_time.csv'
+cases_today_file = 'cases_country.csv'
 
 data_base_path = 'data'
 countries_params_file = 'countries_params.json'
-
-countries_source = set(pd.read_csv(os.path.join(source_path, cases_time_file))['Country_Region'].unique())
+snapshot_path = os.path.join('state', 'snapshot')
 
 with open(os.path.join(data_base_path, countries_params_file)) as f:
-    countries_data_base = set(pd.DataFrame.from_dict(json.load(f), orient='index').index.unique())
+    countries_params = json.load(f)
+countries_data_base = set(pd.DataFrame.from_dict(countries_params, orient='index').index.unique())
+
+places = snapshot_places(snapshot_path, source_path, cases_time_file, cases_today_file)
+if places is None:
+    places = pd.read_csv(os.path.join(source_path, cases_time_file),
+                         usecols=['Country_Region'])['Country_Region'].unique()
+else:
+    # World and the regions are summed up into the snapshot, they are not in the source
+    places = set(places) - aggregate_places(countries_params)
+countries_source = set(places)
 
 print('countries_source - countries_data_base = ', countries_source - countries_data_base)
 print()
@@ -1,10 +1,13 @@
 import argparse
 import datetime
 import os
+import sys
 from os import path
 import json
 
-from process_procedures import process, preprocess
+from process_procedures import process, preprocess, aggregate_params, NoRegionsError
+from forecast_store import ForecastStore
+from precompute_forecasts import precompute_forecasts
 
 parser = argparse.ArgumentParser(description='COVID-19 disease daily plotting script',
                                  epilog='Forecast works mostly under manual control, but works '
@@ -13,7 +16,9 @@ parser = argparse.ArgumentParser(description='COVID-19 disease daily plotting sc
                                         'linear=a*x+b, poly=a*x^3+b*x^2+c*x+d, '
                                         'covid=(a*x+b)*exp(c/x+d), '
                                         'cnn is preconfigured convolutional neural network, while '
-                                        'ldm is preconfigured linear model with dense layer',
+                                        'ldm is preconfigured linear model with dense layer, '
+                                        'cnn_global and ldm_global are the same networks trained '
+                                        'on all regions by --precompute',
                                  prog='covid_plot')
 
 parser.add_argument('--nonlog', default=False, action='store_true',
@@ -27,10 +32,10 @@ parser.add_argument('--current_day', default=False, action='store_true',
 parser.add_argument('--deaths', default=False, action='store_true',
                     help='show deaths')
 parser.add_argument('--forec_confirmed', type=str, nargs='+', default=[],
-                    help='set function type (linear, poly, covid, cnn or ldm), '
+                    help='set function type (linear, poly, covid, cnn, ldm, cnn_global or ldm_global), '
                          'forward and backward days for forecast confirmed cases: type n n')
 parser.add_argument('--forec_deaths', type=str, nargs='+', default=[],
-                    help='set function type (linear, poly, covid, cnn or ldm), '
+                    help='set function type (linear, poly, covid, cnn, ldm, cnn_global or ldm_global), '
                          'forward and backward days for forecast deaths: type n n')
 parser.add_argument('--regions', type=str, nargs='+', default=['Russia'],
                     help='set list of regions to be plotted')
@@ -41,6 +46,10 @@ parser.add_argument('--nonabs', default=False, action='store_true',
                     help='set number of people as fraction of population')
 parser.add_argument('--daily', default=False, action='store_true',
                     help='show daily data')
+parser.add_argument('--jobs', type=int, default=1,
+                    help='set number of processes computing forecasts')
+parser.add_argument('--precompute', default=False, action='store_true',
+                    help='update data, precompute default forecasts of the web service and exit')
 
 args = parser.parse_args()
 
@@ -48,11 +57,14 @@ cwd = os.getcwd()
 covid_data_path = "COVID-19/data"
 cases_file = "cases_time.csv"
 cases_today_file = "cases_country.csv"
+snapshot_path = "state/snapshot"
+forecast_store = ForecastStore("state/forecasts")
 
 countries_params_path = '.'
 countries_params_file = path.join(countries_params_path, 'data/countries_params.json')
 with open(countries_params_file, 'r', encoding='utf-8') as f:
     countries_params = json.load(f)
+places_params = aggregate_params(countries_params)
 
 if os.path.isdir(covid_data_path):
     os.chdir(covid_data_path)
@@ -64,5 +76,18 @@ else:
     os.system("git checkout web-data")
     os.chdir("..")
 
-cases, cases_today = preprocess(args, covid_data_path, cases_file, cases_today_file)
-process(args, cases, cases_today, countries_params)
+# rebuilds the columnar snapshot if the pull brought new data
+cases, cases_today = preprocess(args, covid_data_path, cases_file, cases_today_file,
+                                snapshot_path=snapshot_path, update_snapshot=True,
+                                countries_params=countries_params)
+
+if args.precompute:
+    precompute_forecasts(cases, cases_today, countries_params, forecast_store, n_jobs=args.jobs)
+    sys.exit(0)
+
+try:
+    process(args, cases, cases_today, places_params, forecast_store=forecast_store,
+            forecast_jobs=args.jobs)
+except NoRegionsError as e:
+    print(e, file=sys.stderr)
+    sys.exit(-1)
@@ -1,14 +1,23 @@
 #!/usr/bin/env python3
 # coding: utf-8
 
+import hashlib
 import json
-from datetime import datetime
+import os
+from datetime import date
 from os import path
 from types import SimpleNamespace
+from urllib.parse import urlencode
 from flask import render_template, Blueprint
-from flask import request
-from process_procedures import process, preprocess
-import hashlib
+from flask import request, jsonify, url_for, redirect, Response, make_response
+import process_procedures
+from process_procedures import (process, aggregate_params, compute_regions, forecast_functions, is_neural,
+                                global_methods, global_model_version, NoRegionsError)
+from cases_cache import CasesCache
+from plot_cache import PlotCache, normalize_args
+from forecast_store import ForecastStore
+from forecast_worker import ForecastWorkerClient
+from series_data import region_series, series_etag
 
 # basedir = '.'
 basedir = '/var/www/html/covid/'
@@ -19,11 +28,40 @@ covid_service = Blueprint('covid_service', __name__, template_folder='templates'
 base_path = path.join(basedir, 'COVID-19/data')
 cases_file = "cases_time.csv"
 cases_today_file = "cases_country.csv"
+# internal state of the service is kept in state/, only data/ is served
+snapshot_path = path.join(basedir, 'state', 'snapshot')
+
+# rendered plots, served from data/plots
+plots_dir = 'plots'
+plot_cache_max_entries = 2000
+plot_cache_max_bytes = 256 * 2 ** 20
+plot_cache = PlotCache(path.join(basedir, 'data', plots_dir),
+                       plot_cache_max_entries, plot_cache_max_bytes)
+
+# predictions of the neural forecasts, so that models are not retrained
+forecast_store = ForecastStore(path.join(basedir, 'state', 'forecasts'))
+# forecasts missing in the store are computed in the request thread: fits
+# take milliseconds and neural models are trained by the forecast worker,
+# while forking the multithreaded web process could deadlock the child
+forecast_jobs = 1
+# global neural models, trained by precompute_forecasts.py
+process_procedures.global_model_dir = path.join(basedir, 'state', 'models')
+# neural models are trained by forecast_worker.py, tensorflow is not loaded here
+process_procedures.neural_worker = ForecastWorkerClient(
+    path.join(basedir, 'state', 'forecast_worker.sock'),
+    os.environ.get('FORECAST_WORKER_AUTHKEY', '').encode())
 
 with open(countries_file, 'r', encoding='utf-8') as f:
-    countries_data = json.load(f)
+    countries_params = json.load(f)
+
+# parsed case tables shared by all requests of the process
+cases_cache = CasesCache(base_path, cases_file, cases_today_file, snapshot_path,
+                         countries_params)
 
-all_countries = [el[0] for el in sorted(countries_data.items(), key=lambda x: x[1]['country_ru'])]
+# countries together with the regions and subregions
+countries_data = aggregate_params(countries_params)
+
+all_countries = [el[0] for el in sorted(countries_params.items(), key=lambda x: x[1]['country_ru'])]
 
 w_pos = all_countries.index('World')
 all_countries.insert(0, all_countries.pop(w_pos))
@@ -37,79 +75,228 @@ all_countries.insert(len(all_countries), all_countries.pop(d_pos))
 d_pos = all_countries.index('MS Zaandam')
 all_countries.insert(len(all_countries), all_countries.pop(d_pos))
 
+all_aggregates = sorted(set(countries_data) - set(countries_params),
+                        key=lambda x: countries_data[x]['country_ru'])
+all_countries[2:2] = all_aggregates
+
+
+# seconds for which proxies may serve chart pages without asking
+page_max_age = 300
+# pages change with the template
+template_version = '%x' % os.stat(path.join(path.dirname(path.abspath(__file__)),
+                                            'templates', 'covid.html')).st_mtime_ns
+
+
+def render_page(**params):
+    """Render covid.html with params, a conditional GET of an unchanged page gets 304.
+
+    The page depends only on params and the template: plot file names
+    include the data version and the series have own ETags. Chart pages
+    requested with GET may be kept by proxies for page_max_age seconds.
+    """
+    etag = hashlib.md5(json.dumps([params, template_version], sort_keys=True).encode()).hexdigest()
+    if request.method == 'GET' and etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = make_response(render_template("covid.html", countries=all_countries,
+                                                 countries_data=countries_data, **params))
+    response.set_etag(etag)
+    if request.method == 'GET':
+        response.cache_control.public = True
+        response.cache_control.max_age = page_max_age
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+def form_chart(form):
+    """Chart parameters of the submitted form, see query_chart."""
+    chart = dict(chosen_countries=form.getlist('country'), log=form.get('log'), daily=form.get('daily'),
+                 nonabs=form.get('nonabs'), deaths=form.get('deaths'), current_day=form.get('current_day'),
+                 from_date=form.get('from_date'), client=form.get('client'),
+                 forec_confirmed=[], forec_deaths=[])
+    if form.get('forec-confirmed'):
+        chart['forec_confirmed'] = [form.get('confirmed_function'), form.get('for_period_confirmed'),
+                                    form.get('on_period_confirmed')]
+    if form.get('forec-deaths'):
+        chart['forec_deaths'] = [form.get('deaths_function'), form.get('for_period_deaths'),
+                                 form.get('on_period_deaths')]
+    return chart
+
+
+def query_chart(query):
+    """Chart parameters of a chart URL, flags are set by non-empty values."""
+    return dict(chosen_countries=query.getlist('country'), log=query.get('log'), daily=query.get('daily'),
+                nonabs=query.get('nonabs'), deaths=query.get('deaths'),
+                current_day=query.get('current_day'), from_date=query.get('from_date', ''),
+                client=query.get('client'),
+                forec_confirmed=query.get('forec_confirmed', '').split(',') if query.get('forec_confirmed') else [],
+                forec_deaths=query.get('forec_deaths', '').split(',') if query.get('forec_deaths') else [])
+
+
+def chart_args(chart):
+    """Arguments of process for the chart, ValueError if they are wrong."""
+    if not chart['chosen_countries'] or set(chart['chosen_countries']) - set(all_countries):
+        raise ValueError("Выберите страны из списка!")
+    if chart['from_date']:
+        try:
+            date.fromisoformat(chart['from_date'])
+        except ValueError:
+            raise ValueError("Неверная дата начала графика!")
+    try:
+        for forec_args in [chart['forec_confirmed'], chart['forec_deaths']]:
+            if forec_args:
+                series_forecast(','.join(str(x) for x in forec_args))
+    except NoGlobalModelError:
+        raise ValueError("Для сети, обученной на всех странах, нет модели с такими периодами прогноза!")
+    except ValueError:
+        raise ValueError("Неверные параметры прогноза!")
+    return SimpleNamespace(deaths=chart['deaths'], list=False, current_day=chart['current_day'],
+                           from_date=chart['from_date'], nonlog=not chart['log'],
+                           regions=chart['chosen_countries'],
+                           forec_confirmed=chart['forec_confirmed'], forec_deaths=chart['forec_deaths'],
+                           forec_current_day=[], nonabs=chart['nonabs'], daily=chart['daily'])
+
+
+def chart_query(args, client):
+    """Query of the canonical chart URL, charts with equal plot keys get equal queries."""
+    params = normalize_args(args)
+    query = [('country', region) for region in params['regions']]
+    for name, value in [('log', not params['nonlog']), ('daily', params['daily']), ('deaths', params['deaths']),
+                        ('nonabs', params['nonabs']), ('current_day', params['current_day']),
+                        ('client', bool(client))]:
+        if value:
+            query.append((name, '1'))
+    if params['from_date']:
+        query.append(('from_date', params['from_date']))
+    for name in ['forec_confirmed', 'forec_deaths']:
+        if params[name]:
+            query.append((name, ','.join(params[name])))
+    return query
+
+
+def render_chart(args):
+    """Render the plot of args unless it is cached.
+
+    Return its path in data/, True if it was rendered by this call and the
+    (region, field) pairs of the forecasts which failed, e.g. while the
+    forecast worker is down. Raise NoRegionsError if no chosen country has data.
+    """
+    # the plot file name depends on the parameters and the data version
+    cases, cases_today, data_version = cases_cache.get()
+    key = plot_cache.key(args, data_version)
+    failed = []
+
+    def draw(plot_file_name):
+        failed.extend(process(args, cases, cases_today, countries_data,
+                              plot_file_name=plot_file_name, use_agg=True, forecast_store=forecast_store,
+                              forecast_jobs=forecast_jobs))
+        # a plot without some forecasts is not cached, the next request tries them again
+        return not failed
+
+    file_name, rendered = plot_cache.render(key, draw)
+    return plots_dir + '/' + file_name, rendered, failed
+
 
 @covid_service.route('/', methods=['GET', 'POST'])
 def show_plot():
-    chosen_countries = []
-    log = True
-    daily = True
-    nonabs = False
-    deaths = True
-    current_day = False
-    from_date = "2020-03-01"
-    forec_confirmed = []
-    forec_deaths = []
+    if request.method == 'GET' and 'country' not in request.args:
+        return render_page(chosen_countries=[], log=True, deaths=True, current_day=False,
+                           from_date="2020-03-01", forec_confirmed=[], forec_deaths=[],
+                           nonabs=False, daily=True, client=False)
+
+    chart = form_chart(request.form) if request.method == 'POST' else query_chart(request.args)
+    try:
+        args = chart_args(chart)
+    except ValueError as e:
+        return render_page(error=str(e))
+
+    # a chart has one URL, so that caches in front of the service keep it once
+    query = chart_query(args, chart['client'])
+    url = url_for('covid_service.show_plot') + '?' + urlencode(query, safe=',')
     if request.method == 'POST':
-        chosen_countries = request.form.getlist('country')
-        log = request.form.get('log')
-        daily = request.form.get('daily')
-        nonabs = request.form.get('nonabs')
-        deaths = request.form.get('deaths')
-        current_day = request.form.get('current_day')
-        from_date = request.form.get('from_date')
-
-        forec_confirmed_checked = request.form.get('forec-confirmed')
-        forec_deaths_checked = request.form.get('forec-deaths')
-        if forec_confirmed_checked:
-            forec_confirmed_func = request.form.get('confirmed_function')
-            forec_confirmed.append(forec_confirmed_func)
-            forec_confirmed.append(request.form.get('for_period_confirmed'))
-            forec_confirmed.append(request.form.get('on_period_confirmed'))
-
-        if forec_deaths_checked:
-            forec_deaths_func = request.form.get('deaths_function')
-            forec_deaths.append(forec_deaths_func)
-            forec_deaths.append(request.form.get('for_period_deaths'))
-            forec_deaths.append(request.form.get('on_period_deaths'))
-
-        nonlog = False
-        if not log:
-            nonlog = True
-
-        if set(chosen_countries) - set(all_countries):
-            return render_template("covid.html", error="Выберите страны из списка!",
-                                   countries=all_countries, countries_data=countries_data)
-        args = SimpleNamespace(deaths=deaths, list=False, current_day=current_day,
-                               from_date=from_date, nonlog=nonlog,
-                               regions=chosen_countries,
-                               forec_confirmed=forec_confirmed, forec_deaths=forec_deaths,
-                               forec_current_day=[], nonabs=nonabs, daily=daily)
-        cases, cases_today = preprocess(args, base_path, cases_file, cases_today_file)
-
-        # Creating unique filename for the plot
-        params = '_'.join([str(getattr(args, i)) for i in vars(args)])
-        params = params + datetime.now().strftime('%Y-%m-%d-%H')
-        m = hashlib.md5()
-        name = params.encode('ascii', 'backslashreplace')
-        m.update(name)
-        fname = m.hexdigest()
-        out_image = fname + '.png'
-
-        imagepath = path.join(basedir, 'data', out_image)
-        if not path.isfile(imagepath):
-            _ = process(args, cases, cases_today, countries_data,
-                        plot_file_name=imagepath, use_agg=True)
-        return render_template("covid.html", image=out_image, countries=all_countries,
-                               countries_data=countries_data,
-                               chosen_countries=chosen_countries,
-                               log=log, deaths=deaths, current_day=current_day,
-                               from_date=from_date,
-                               forec_confirmed=forec_confirmed, forec_deaths=forec_deaths,
-                               nonabs=nonabs, daily=daily)
+        return redirect(url, 303)
+    if list(request.args.items(multi=True)) != query:
+        return redirect(url, 301)
+
+    if chart['client']:
+        # the browser draws the chart from the series
+        chart['series_url'] = url_for('covid_service.series', country=args.regions,
+                                      nonabs=args.nonabs, current_day=args.current_day,
+                                      forec_confirmed=','.join(args.forec_confirmed) or None,
+                                      forec_deaths=','.join(args.forec_deaths) or None)
+        return render_page(**chart)
+
+    try:
+        chart['image'], _, failed = render_chart(args)
+    except NoRegionsError:
+        return render_page(error="Нет данных по выбранным странам!")
+    if not failed:
+        return render_page(**chart)
+
+    response = render_page(error="Прогноз временно недоступен!", **chart)
+    # the page is not kept, the next request computes the forecasts again
+    response.cache_control.public = False
+    response.cache_control.max_age = None
+    response.cache_control.no_cache = True
+    return response
+
+
+class NoGlobalModelError(ValueError):
+    pass
+
+
+def series_forecast(value):
+    # method,for_period,on_period
+    if not value:
+        return []
+    forec_args = value.split(',')
+    if len(forec_args) != 3 or not all(x.isdigit() and int(x) > 0 for x in forec_args[1:]):
+        raise ValueError('forecast should be method,for_period,on_period: ' + value)
+    if forec_args[0] not in forecast_functions and not is_neural(forec_args[0]):
+        raise ValueError('no such forecast method: ' + forec_args[0])
+    if forec_args[0] in global_methods and not global_model_version(forec_args):
+        # precompute_forecasts.py trains the global models for its windows only
+        raise NoGlobalModelError('no trained global model %s for %s days on %s days' % tuple(forec_args))
+    return forec_args
+
+
+@covid_service.route('/api/series')
+def series():
+    """Series of the chosen countries and their forecasts for the charts drawn by the browser.
+
+    Query: country (repeated), nonabs, current_day,
+    forec_confirmed and forec_deaths as method,for_period,on_period.
+    """
+    chosen_countries = request.args.getlist('country')
+    if not chosen_countries or set(chosen_countries) - set(all_countries):
+        return jsonify(error="Выберите страны из списка!"), 400
+    try:
+        forec_confirmed = series_forecast(request.args.get('forec_confirmed'))
+        forec_deaths = series_forecast(request.args.get('forec_deaths'))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    args = SimpleNamespace(regions=chosen_countries, nonabs=bool(request.args.get('nonabs')),
+                           current_day=bool(request.args.get('current_day')), forec_current_day=[],
+                           forec_confirmed=forec_confirmed, forec_deaths=forec_deaths)
+    cases, cases_today, data_version = cases_cache.get()
+
+    # the series change only with the data, revalidation is answered without computing them
+    etag = series_etag(args, data_version)
+    if etag in request.if_none_match:
+        response = Response(status=304)
     else:
-        return render_template("covid.html", countries=all_countries,
-                               countries_data=countries_data,
-                               chosen_countries=chosen_countries, log=log, deaths=deaths,
-                               current_day=current_day, from_date=from_date,
-                               forec_confirmed=forec_confirmed, forec_deaths=forec_deaths,
-                               nonabs=nonabs, daily=daily)
+        regions = sorted(set(chosen_countries) & set(cases['Place'].unique()))
+        if not regions:
+            return jsonify(error="Нет данных по выбранным странам"), 404
+        region_cases, _, predictions, failed = compute_regions(args, cases, cases_today, countries_data,
+                                                               regions, forecast_store, forecast_jobs)
+        response = jsonify(region_series(args, regions, region_cases, predictions, countries_data,
+                                         data_version))
+        if failed:
+            # series without some forecasts are not revalidated, they are computed again
+            etag = None
+    if etag:
+        response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
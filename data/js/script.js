@@ -147,4 +147,313 @@
       });
     });
   }
-})();
\ No newline at end of file
+})();
+
+(function() {
+  // chart of the /api/series response; scale, daily cases, deaths and
+  // the first date are applied here without requests to the server
+  let chart = document.querySelector('.js-chart');
+
+  if (!chart) {
+    return;
+  }
+
+  let colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+                '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf'];
+  let months = ['янв', 'фев', 'мар', 'апр', 'май', 'июн', 'июл', 'авг', 'сен', 'окт', 'ноя', 'дек'];
+  let dayMs = 24 * 60 * 60 * 1000;
+  let context = chart.getContext('2d');
+  let series = null;
+
+  let option = function (id) {
+    let input = document.querySelector('#' + id);
+    return input ? input.checked : false;
+  };
+
+  let fromDay = function () {
+    let input = document.querySelector('#from_date');
+    let time = input ? Date.parse(input.value) : NaN;
+    return isNaN(time) ? null : Math.round((time - Date.parse(series.start)) / dayMs);
+  };
+
+  let dayDate = function (day) {
+    return new Date(Date.parse(series.start) + day * dayMs);
+  };
+
+  let niceStep = function (range) {
+    let step = Math.pow(10, Math.floor(Math.log10(range / 5)));
+    if (range / step > 25) {
+      step *= 5;
+    } else if (range / step > 10) {
+      step *= 2;
+    }
+    return step;
+  };
+
+  // scale of an axis, log scales take positive values only
+  let makeScale = function (values, log, from, to) {
+    values = values.filter(function (value) {
+      return value !== null && (!log || value > 0);
+    });
+    let min = values.length ? Math.min.apply(null, values) : 1;
+    let max = values.length ? Math.max.apply(null, values) : 10;
+    let f = log ? Math.log10 : function (value) { return value; };
+    let lo = f(min);
+    let hi = f(max);
+    let pad = (hi - lo || 1) * 0.05;
+    lo -= pad;
+    hi += pad;
+    let ticks = [];
+    if (log) {
+      for (let p = Math.ceil(lo); p <= hi; p++) {
+        ticks.push(Math.pow(10, p));
+      }
+    } else {
+      let step = niceStep(hi - lo);
+      for (let t = Math.ceil(lo / step) * step; t <= hi; t += step) {
+        ticks.push(t);
+      }
+    }
+    return {
+      ticks: ticks,
+      map: function (value) {
+        if (value === null || (log && value <= 0)) {
+          return null;
+        }
+        return from + (f(value) - lo) / (hi - lo) * (to - from);
+      }
+    };
+  };
+
+  let tickLabel = function (value, log) {
+    if (log) {
+      let p = Math.round(Math.log10(value));
+      return p >= -2 && p <= 6 ? String(value.toFixed(Math.max(0, -p))) : '1e' + p;
+    }
+    return Math.abs(value) >= 1e6 ? value.toExponential(1) : String(+value.toPrecision(6));
+  };
+
+  let drawLine = function (days, values, x, y, style) {
+    context.save();
+    context.strokeStyle = style.color;
+    context.fillStyle = style.color;
+    context.lineWidth = style.width;
+    context.setLineDash(style.dash || []);
+    context.beginPath();
+    let drawing = false;
+    for (let i = 0; i < days.length; i++) {
+      let px = x(days[i]);
+      let py = y(values[i]);
+      if (px === null || py === null) {
+        drawing = false;
+        continue;
+      }
+      if (drawing) {
+        context.lineTo(px, py);
+      } else {
+        context.moveTo(px, py);
+        drawing = true;
+      }
+    }
+    context.stroke();
+    if (style.square) {
+      for (let i = 0; i < days.length; i++) {
+        let px = x(days[i]);
+        let py = y(values[i]);
+        if (px !== null && py !== null) {
+          context.fillRect(px - style.square / 2, py - style.square / 2, style.square, style.square);
+        }
+      }
+    }
+    context.restore();
+  };
+
+  let draw = function () {
+    let log = option('log');
+    let daily = option('daily');
+    let deaths = option('deaths') || series.regions.some(function (region) {
+      return region.forecasts.deaths;
+    });
+    let width = chart.width;
+    let height = chart.height;
+    let box = {left: 110, right: width - (daily ? 110 : 30), top: 50, bottom: height - 50};
+
+    // visible days
+    let first = fromDay();
+    let last = 0;
+    series.regions.forEach(function (region) {
+      Object.keys(region.forecasts).forEach(function (field) {
+        last = Math.max(last, region.forecasts[field].days[region.forecasts[field].days.length - 1]);
+      });
+      last = Math.max(last, region.days[region.days.length - 1]);
+      if (first === null) {
+        first = region.days[0];
+      }
+    });
+    first = Math.min(first, last - 1);
+    let visible = function (days, values) {
+      return values.filter(function (value, i) {
+        return days[i] >= first && days[i] <= last;
+      });
+    };
+
+    let totals = [];
+    let dailies = [];
+    series.regions.forEach(function (region) {
+      totals = totals.concat(visible(region.days, region.confirmed));
+      if (deaths) {
+        totals = totals.concat(visible(region.days, region.deaths));
+      }
+      dailies = dailies.concat(visible(region.days, region.confirmed_daily));
+      Object.keys(region.forecasts).forEach(function (field) {
+        let forecast = region.forecasts[field];
+        totals = totals.concat(visible(forecast.days, forecast.values));
+        if (forecast.daily) {
+          dailies = dailies.concat(visible(forecast.days, forecast.daily));
+        }
+      });
+    });
+
+    let x = function (day) {
+      if (day < first || day > last) {
+        return null;
+      }
+      return box.left + (day - first) / (last - first) * (box.right - box.left);
+    };
+    let y1 = makeScale(totals, log, box.bottom, box.top);
+    let y2 = makeScale(dailies, false, box.bottom, box.top);
+
+    context.clearRect(0, 0, width, height);
+    context.fillStyle = '#fff';
+    context.fillRect(0, 0, width, height);
+    context.font = '16px sans-serif';
+    context.fillStyle = '#000';
+    context.strokeStyle = '#b0b0b0';
+    context.lineWidth = 1;
+
+    // grid and ticks of the main axis
+    context.textAlign = 'right';
+    context.textBaseline = 'middle';
+    y1.ticks.forEach(function (tick) {
+      let py = y1.map(tick);
+      context.beginPath();
+      context.moveTo(box.left, py);
+      context.lineTo(box.right, py);
+      context.stroke();
+      context.fillText(tickLabel(tick, log), box.left - 6, py);
+    });
+    if (daily) {
+      context.textAlign = 'left';
+      y2.ticks.forEach(function (tick) {
+        context.fillText(tickLabel(tick, false), box.right + 6, y2.map(tick));
+      });
+    }
+
+    // months
+    context.textAlign = 'center';
+    context.textBaseline = 'top';
+    for (let day = first; day <= last; day++) {
+      let date = dayDate(day);
+      if (date.getUTCDate() !== 1) {
+        continue;
+      }
+      let px = x(day);
+      context.beginPath();
+      context.moveTo(px, box.top);
+      context.lineTo(px, box.bottom);
+      context.stroke();
+      let month = date.getUTCMonth();
+      context.fillText(month === 0 ? String(date.getUTCFullYear()) : months[month], px, box.bottom + 6);
+    }
+
+    context.strokeStyle = '#000';
+    context.strokeRect(box.left, box.top, box.right - box.left, box.bottom - box.top);
+
+    // titles
+    let title = 'Подтвержденные (—)' + (daily ? ' и новые (▪)' : '') + ' случаи' +
+      (deaths ? ', смерти (---)' : '');
+    context.font = '20px sans-serif';
+    context.textBaseline = 'bottom';
+    context.fillText(title, width / 2, box.top - 8);
+    context.font = '16px sans-serif';
+    let axisTitle = function (text, px) {
+      context.save();
+      context.translate(px, (box.top + box.bottom) / 2);
+      context.rotate(-Math.PI / 2);
+      context.textBaseline = 'middle';
+      context.fillText(text, 0, 0);
+      context.restore();
+    };
+    axisTitle(series.nonabs ? 'Всего (доля населения)' : 'Всего (человек)', 20);
+    if (daily) {
+      axisTitle('Новые случаи (человек)', width - 15);
+    }
+
+    context.save();
+    context.beginPath();
+    context.rect(box.left, box.top, box.right - box.left, box.bottom - box.top);
+    context.clip();
+    series.regions.forEach(function (region, i) {
+      let color = colors[i % colors.length];
+      if (daily) {
+        drawLine(region.days, region.confirmed_daily, x, y2.map, {color: color, width: 0.5, square: 5});
+      }
+      drawLine(region.days, region.confirmed, x, y1.map, {color: color, width: 3});
+      if (deaths) {
+        drawLine(region.days, region.deaths, x, y1.map, {color: color, width: 3, dash: [8, 4]});
+      }
+      let confirmed = region.forecasts.confirmed;
+      if (confirmed) {
+        drawLine(confirmed.days, confirmed.values, x, y1.map, {color: color, width: 1.5});
+        if (daily && confirmed.daily) {
+          drawLine(confirmed.days, confirmed.daily, x, y2.map, {color: color, width: 0.3, square: 3});
+        }
+      }
+      if (region.forecasts.deaths) {
+        drawLine(region.forecasts.deaths.days, region.forecasts.deaths.values, x, y1.map,
+                 {color: color, width: 1.5, dash: [6, 3]});
+      }
+    });
+    context.restore();
+
+    // legend
+    context.textAlign = 'left';
+    context.textBaseline = 'middle';
+    series.regions.forEach(function (region, i) {
+      let py = box.top + 20 + i * 22;
+      context.fillStyle = colors[i % colors.length];
+      context.fillRect(box.left + 12, py - 3, 36, 6);
+      context.fillStyle = '#000';
+      context.fillText(region.name, box.left + 56, py);
+    });
+  };
+
+  fetch(chart.dataset.series)
+    .then(function (response) {
+      return response.json().then(function (data) {
+        if (!response.ok) {
+          throw new Error(data.error);
+        }
+        return data;
+      });
+    })
+    .then(function (data) {
+      series = data;
+      draw();
+      ['log', 'daily', 'deaths'].forEach(function (id) {
+        let input = document.querySelector('#' + id);
+        if (input) {
+          input.addEventListener('change', draw);
+        }
+      });
+      let fromDate = document.querySelector('#from_date');
+      if (fromDate) {
+        fromDate.addEventListener('input', draw);
+      }
+    })
+    .catch(function (error) {
+      context.font = '20px sans-serif';
+      context.fillStyle = '#c00';
+      context.fillText(String(error.message || error), 20, 40);
+    });
+})();
@@ -0,0 +1,109 @@
+import os
+import threading
+
+
+class FileCache:
+    """Directory of cached files with a size cap and LRU eviction.
+
+    Modification time of a file is its last use, which lets several worker
+    processes share one directory. Files being written have `tmp_prefix`
+    and are not counted.
+
+    The directory is scanned for eviction only when a running estimate of
+    its entries and bytes goes over a cap, or every `scan_interval` writes
+    to count the files written by other processes. An eviction goes down
+    to `low_water` of the caps, so a full cache is not scanned every write.
+    """
+
+    suffix = ''
+    tmp_prefix = 'tmp-'
+    scan_interval = 100
+    low_water = 0.9
+
+    def __init__(self, directory, max_entries, max_bytes):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # estimate of the directory since the last scan, unknown before it
+        self._entries = None
+        self._bytes = 0
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def file_name(self, key):
+        return key + self.suffix
+
+    def path(self, key):
+        return os.path.join(self.directory, self.file_name(key))
+
+    def tmp_path(self, key):
+        return os.path.join(self.directory, '%s%s-%d-%d%s' % (self.tmp_prefix, key, os.getpid(),
+                                                              threading.get_ident(), self.suffix))
+
+    def count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def lookup(self, key):
+        """Return True and mark the file as recently used if it is cached."""
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            self.count(False)
+            return False
+        self.count(True)
+        return True
+
+    def entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(self.suffix) or entry.name.startswith(self.tmp_prefix) \
+                        or entry.name.startswith('.'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self, added_bytes=0):
+        """Count a written file of added_bytes, remove the least recently used files over the caps."""
+        with self._lock:
+            self._writes += 1
+            if self._entries is not None:
+                self._entries += 1
+                self._bytes += added_bytes
+                if self._writes < self.scan_interval and self._entries <= self.max_entries \
+                        and self._bytes <= self.max_bytes:
+                    return
+            self._writes = 0
+
+        entries = sorted(self.entries())
+        total_bytes = sum(size for _, size, _ in entries)
+        max_entries, max_bytes = self.max_entries, self.max_bytes
+        if len(entries) > max_entries or total_bytes > max_bytes:
+            max_entries, max_bytes = int(max_entries * self.low_water), int(max_bytes * self.low_water)
+        while entries and (len(entries) > max_entries or total_bytes > max_bytes):
+            _, size, file_path = entries.pop(0)
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+            with self._lock:
+                self.evictions += 1
+        with self._lock:
+            self._entries = len(entries)
+            self._bytes = total_bytes
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,156 @@
+import time
+import numpy as np
+from scipy.optimize import least_squares
+
+
+def func_linear(x, a, b):
+    return a * x + b
+
+
+def func_poly(x, a, b, c, d):
+    return a * x ** 3 + b * x ** 2 + c * x + d
+
+
+def func_covid(x, a, b, c, d):
+    return (a * x + b) * np.exp(c / x + d)
+
+
+poly_degrees = {'linear': 1, 'poly': 3}
+
+# limits of one covid fit
+covid_max_nfev = 2000
+covid_time_budget = 5.
+covid_c_bound = 30.
+
+
+class FitError(Exception):
+    pass
+
+
+class FitTimeout(Exception):
+    pass
+
+
+def fit_polynomial(x, y, degree):
+    """Closed form least squares, return the function of x with fitted parameters."""
+    if len(x) == 0:
+        raise FitError('no data to fit')
+    # centred and scaled time keeps the normal equations well-conditioned
+    x_mean = x.mean()
+    x_scale = max(np.abs(x - x_mean).max(), 1.)
+    coef = np.polynomial.polynomial.polyfit((x - x_mean) / x_scale, y, degree)
+    return lambda x_new: np.polynomial.polynomial.polyval((np.asarray(x_new, dtype=float) - x_mean) / x_scale,
+                                                          coef)
+
+
+def fit_polynomial_batch(x, values, degree):
+    """Fit one polynomial per row of values (n_series x n_days) over common days x.
+
+    All the series are solved as one least squares problem with a shared
+    design matrix. Return the coefficients (n_series x degree + 1) in
+    centred and scaled x and the function of x giving all the curves
+    (n_series x len(x)). Rows with missing values are fitted one by one
+    on their known days.
+    """
+    x = np.asarray(x, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if len(x) == 0:
+        raise FitError('no data to fit')
+    x_mean = x.mean()
+    x_scale = max(np.abs(x - x_mean).max(), 1.)
+    t = (x - x_mean) / x_scale
+
+    coef = np.empty((values.shape[0], degree + 1))
+    known = np.isfinite(values).all(axis=1)
+    if known.any():
+        coef[known] = np.polynomial.polynomial.polyfit(t, values[known].T, degree).T
+    for row in np.flatnonzero(~known):
+        finite = np.isfinite(values[row])
+        if not finite.any():
+            raise FitError('no data to fit in series %d' % row)
+        coef[row] = np.polynomial.polynomial.polyfit(t[finite], values[row, finite], degree)
+
+    def func(x_new):
+        t_new = (np.asarray(x_new, dtype=float) - x_mean) / x_scale
+        return np.polynomial.polynomial.polyval(t_new, coef.T)
+
+    return coef, func
+
+
+def fit_covid(x, y, warm_start=None, max_nfev=covid_max_nfev, time_budget=covid_time_budget):
+    """Fit func_covid, return the function of x and its (a, b, c, d).
+
+    The same family of curves is fitted as (A * s + B) * exp(C * u) with
+    s the centred and scaled x and u the centred and scaled 1 / x; exp(d)
+    and the shift of 1 / x are absorbed by A and B. Values are scaled by
+    their maximum, so all three parameters are of order one.
+    """
+    if len(x) < 3:
+        raise FitError('at least 3 days are needed for covid fit, %d given' % len(x))
+    x_mean = x.mean()
+    x_scale = max(np.abs(x - x_mean).max(), 1.)
+    inv_mean = (1. / x).mean()
+    inv_scale = np.abs(1. / x - inv_mean).max()
+    y_scale = max(np.abs(y).max(), 1.)
+    if inv_scale == 0.:
+        raise FitError('covid fit needs at least 2 different days')
+    s = (x - x_mean) / x_scale
+    u = (1. / x - inv_mean) / inv_scale
+    z = y / y_scale
+
+    if warm_start is not None:
+        a, b, c, d = warm_start
+        k = np.exp(d + c * inv_mean) / y_scale
+        p0 = [a * x_scale * k, (a * x_mean + b) * k, c * inv_scale]
+    else:
+        # straight line through the data
+        B, A = np.polynomial.polynomial.polyfit(s, z, 1)
+        p0 = [A, B, 0.]
+    if not np.all(np.isfinite(p0)):
+        raise FitError('bad initial guess for covid fit')
+    p0[2] = np.clip(p0[2], -covid_c_bound, covid_c_bound)
+
+    deadline = time.monotonic() + time_budget
+
+    def residuals(p):
+        if time.monotonic() > deadline:
+            raise FitTimeout()
+        return (p[0] * s + p[1]) * np.exp(p[2] * u) - z
+
+    def jacobian(p):
+        e = np.exp(p[2] * u)
+        return np.stack([s * e, e, (p[0] * s + p[1]) * u * e], axis=1)
+
+    try:
+        result = least_squares(residuals, p0, jac=jacobian, max_nfev=max_nfev,
+                               bounds=([-np.inf, -np.inf, -covid_c_bound],
+                                       [np.inf, np.inf, covid_c_bound]))
+    except FitTimeout:
+        raise FitError('covid fit exceeded %.1f s' % time_budget)
+    if result.status <= 0 or not np.all(np.isfinite(result.x)):
+        raise FitError('covid fit failed: ' + result.message)
+
+    A, B, C = result.x
+    params = (A * y_scale / x_scale, (B - A * x_mean / x_scale) * y_scale,
+              C / inv_scale, -C * inv_mean / inv_scale)
+    return lambda x_new: func_covid(np.asarray(x_new, dtype=float), *params), params
+
+
+def fit_curve(func_type, x, y, warm_start=None):
+    """Fit linear, poly or covid function to y(x), return the fitted function of x and its parameters.
+
+    warm_start are the parameters of a previous covid fit of the series,
+    e.g. the previous day fit of the same region, to start the fit from.
+    Parameters are returned for covid fits only.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if func_type in poly_degrees:
+        return fit_polynomial(x, y, poly_degrees[func_type]), None
+
+    try:
+        return fit_covid(x, y, warm_start)
+    except FitError:
+        if warm_start is None:
+            raise
+        return fit_covid(x, y)
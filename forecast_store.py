@@ -0,0 +1,104 @@
+import collections
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from file_cache import FileCache
+
+
+def series_version(cases):
+    """Digest of the region data a forecast is computed from."""
+    hashes = pd.util.hash_pandas_object(cases[['Date', 'Confirmed', 'Deaths']], index=False)
+    return hashlib.md5(hashes.to_numpy().tobytes()).hexdigest()
+
+
+def forecast_key(region, method, forec_args, forec_current_day, data_version, field_name=None):
+    params = json.dumps([region, method, [str(x) for x in forec_args],
+                         bool(forec_current_day), data_version, field_name])
+    m = hashlib.md5()
+    m.update(params.encode('ascii', 'backslashreplace'))
+    return m.hexdigest()
+
+
+class ForecastStore(FileCache):
+    """Forecast predictions on disk with an in-memory LRU front.
+
+    Every prediction is a DataFrame indexed by date, it is kept as a .npz
+    file. Keys include the digest of the data the forecast is computed
+    from, so predictions of stale data are never returned and just age
+    out of the cache.
+
+    The parameters of a covid fit are kept with its prediction and under a
+    key without the data digest, so the fit of the next day data starts
+    from them in any process.
+    """
+
+    suffix = '.npz'
+
+    def __init__(self, directory, max_entries=20000, max_bytes=256 * 2 ** 20, memory_entries=512):
+        super().__init__(directory, max_entries, max_bytes)
+        self.memory_entries = memory_entries
+        self._memory = collections.OrderedDict()
+
+    def _remember(self, key, prediction):
+        with self._lock:
+            self._memory[key] = prediction
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            prediction = self._memory.get(key)
+            if prediction is not None:
+                self._memory.move_to_end(key)
+        if prediction is not None:
+            self.count(True)
+            return prediction
+
+        if not self.lookup(key):
+            return None
+        try:
+            with np.load(self.path(key), allow_pickle=False) as data:
+                prediction = pd.DataFrame(data['values'], index=pd.DatetimeIndex(data['index']),
+                                          columns=data['columns'].tolist())
+        except (OSError, ValueError, KeyError):
+            # removed by eviction in the meantime or broken
+            return None
+        self._remember(key, prediction)
+        return prediction
+
+    def get_params(self, warm_key):
+        """Parameters of the last covid fit stored under warm_key or None."""
+        if not self.lookup(warm_key):
+            return None
+        try:
+            with np.load(self.path(warm_key), allow_pickle=False) as data:
+                return tuple(data['params'].tolist())
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save(self, key, **arrays):
+        tmp_path = self.tmp_path(key)
+        try:
+            np.savez(tmp_path, **arrays)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self.path(key))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict(size)
+
+    def put(self, key, prediction, params=None, warm_key=None):
+        arrays = dict(index=prediction.index.to_numpy(dtype='datetime64[ns]'),
+                      columns=np.array(prediction.columns, dtype=str),
+                      values=prediction.to_numpy(dtype=np.float64))
+        if params is not None:
+            arrays['params'] = np.array(params, dtype=np.float64)
+        self._save(key, **arrays)
+        if params is not None and warm_key is not None:
+            self._save(warm_key, params=arrays['params'])
+        self._remember(key, prediction)
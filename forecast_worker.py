@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Local service training the neural forecast models, so that tensorflow is
+# loaded once here and not in every web worker:
+# FORECAST_WORKER_AUTHKEY=... python3 forecast_worker.py state/forecast_worker.sock
+# Web workers send jobs over the Unix socket with ForecastWorkerClient and
+# the same key. Jobs are pickled, so the worker only listens with the key
+# and its socket is accessible to its user only, outside the served data/.
+
+import argparse
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+from forecast_store import forecast_key, series_version
+
+
+class ForecastWorkerError(Exception):
+    pass
+
+
+class ForecastWorkerClient:
+    """Sends neural forecast jobs to forecast_worker.py and waits for predictions."""
+
+    def __init__(self, address, authkey, timeout=600.):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+
+    def request(self, kind, params):
+        if not self.authkey:
+            raise ForecastWorkerError('forecast worker key is not set, see FORECAST_WORKER_AUTHKEY')
+        try:
+            conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+        except (OSError, AuthenticationError) as e:
+            raise ForecastWorkerError('forecast worker is not available: %s' % e)
+        with conn:
+            conn.send((kind, params))
+            if not conn.poll(self.timeout):
+                raise ForecastWorkerError('forecast worker did not answer in %.0f s' % self.timeout)
+            status, result = conn.recv()
+        if status != 'ok':
+            raise ForecastWorkerError(result)
+        return result
+
+    def forecast(self, forec_args, cases, forec_current_day, nonabs, population):
+        return self.request('neural', (list(forec_args), cases, bool(forec_current_day), bool(nonabs),
+                                       population))
+
+    def forecast_global(self, forec_args, cases_list, forec_current_day, nonabs, populations):
+        return self.request('global', (list(forec_args), list(cases_list), bool(forec_current_day),
+                                       bool(nonabs), list(populations)))
+
+
+class ForecastWorker:
+    """Accepts jobs on a Unix socket and trains models in a bounded pool of threads.
+
+    A job trains one model of neural_forecast or runs one prediction of
+    the global model for many regions. Jobs wait in a queue of max_queue entries, a full queue is reported
+    to the client at once. Equal jobs sent while one is queued or training
+    share its result.
+    """
+
+    def __init__(self, address, authkey, n_trainers=1, max_queue=64):
+        self.address = address
+        self.authkey = authkey
+        self.jobs = queue.Queue(max_queue)
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.trainers = [threading.Thread(target=self.train, daemon=True) for _ in range(n_trainers)]
+
+    def train(self):
+        # imported here, so that clients importing this module stay tensorflow-free
+        from process_procedures import neural_forecast, global_forecast_batch
+
+        run = {'neural': neural_forecast, 'global': global_forecast_batch}
+        while True:
+            key, (kind, params), future = self.jobs.get()
+            try:
+                future.set_result(run[kind](*params))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    del self.in_flight[key]
+
+    def submit(self, kind, params):
+        forec_args, cases, forec_current_day, nonabs, population = params
+        if kind == 'neural':
+            cases, population = [cases], [population]
+        elif kind != 'global':
+            raise ForecastWorkerError('unknown job ' + repr(kind))
+        key = (kind,) + tuple(forecast_key(frame['Place'].iloc[0], forec_args[0], forec_args[1:],
+                                           forec_current_day, series_version(frame), [nonabs, region_population])
+                              for frame, region_population in zip(cases, population))
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is None:
+                future = Future()
+                self.jobs.put_nowait((key, (kind, params), future))
+                self.in_flight[key] = future
+        return future
+
+    def handle(self, conn):
+        with conn:
+            try:
+                kind, params = conn.recv()
+                result = ('ok', self.submit(kind, params).result())
+            except queue.Full:
+                result = ('error', 'forecast worker queue is full')
+            except Exception as e:
+                result = ('error', '%s: %s' % (type(e).__name__, e))
+            try:
+                conn.send(result)
+            except OSError:
+                pass
+
+    def serve_forever(self):
+        if not self.authkey:
+            raise ForecastWorkerError('forecast worker needs a key')
+        socket_dir = os.path.dirname(self.address)
+        if socket_dir:
+            os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        # the socket is created with 0600 permissions
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        for trainer in self.trainers:
+            trainer.start()
+        with listener:
+            print('Forecast worker listens on', self.address, file=sys.stderr)
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, AuthenticationError) as e:
+                    # e.g. failed authentication of a client
+                    print('Connection failed:', e, file=sys.stderr)
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Neural forecast worker for the web service',
+                                     prog='forecast_worker')
+    parser.add_argument('address', nargs='?', default=os.path.join('state', 'forecast_worker.sock'),
+                        help='path of the Unix socket')
+    parser.add_argument('--trainers', type=int, default=1,
+                        help='set number of models trained at the same time')
+    parser.add_argument('--max_queue', type=int, default=64,
+                        help='set number of jobs waiting for training')
+    parser.add_argument('--model_dir', default=os.path.join('state', 'models'),
+                        help='set directory of the global models')
+    args = parser.parse_args()
+
+    authkey = os.environ.get('FORECAST_WORKER_AUTHKEY')
+    if not authkey:
+        print('Set the key of the web service in FORECAST_WORKER_AUTHKEY', file=sys.stderr)
+        sys.exit(-1)
+
+    import process_procedures
+    process_procedures.global_model_dir = args.model_dir
+
+    ForecastWorker(args.address, authkey.encode(), args.trainers, args.max_queue).serve_forever()
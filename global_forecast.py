@@ -0,0 +1,188 @@
+# Global neural forecasts: one cnn or ldm model for given window sizes is
+# trained on the daily cases of all the regions, the region is an embedding
+# input of the model. Models are trained after the data update (see
+# precompute_forecasts.py) and a request only runs one batched prediction.
+# tensorflow is imported by training and prediction, not by this module.
+
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+daily_columns = ['Confirmed_daily', 'Deaths_daily']
+# the earlier days of a region are not used, as in neural_forecast
+min_confirmed = 10000.
+embedding_size = 4
+val_fraction = 0.1
+
+# loaded models by name: (version, model)
+models = {}
+models_lock = threading.Lock()
+
+
+class GlobalModelError(Exception):
+    pass
+
+
+def model_name(base_method, IN_STEPS, OUT_STEPS):
+    return '%s-%d-%d' % (base_method, IN_STEPS, OUT_STEPS)
+
+
+def meta_path(model_dir, name):
+    return os.path.join(model_dir, name + '.json')
+
+
+def weights_path(model_dir, name):
+    return os.path.join(model_dir, name + '.weights.h5')
+
+
+def read_meta(model_dir, name):
+    try:
+        with open(meta_path(model_dir, name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        raise GlobalModelError('no global model %s in %s, run precompute_forecasts.py' % (name, model_dir))
+
+
+def model_version(model_dir, base_method, IN_STEPS, OUT_STEPS):
+    """Version of the trained model, it changes with every training."""
+    return read_meta(model_dir, model_name(base_method, IN_STEPS, OUT_STEPS))['version']
+
+
+def region_daily(cases, forec_current_day, scale=1.):
+    # the last day is partial unless it is forecasted from
+    df = cases
+    if not forec_current_day:
+        df = df[df.Date != df.Date.max()]
+    return df[df.Confirmed * scale >= min_confirmed]
+
+
+def build_model(backend, n_regions, IN_STEPS, OUT_STEPS):
+    import tensorflow as tf
+
+    n_features = len(daily_columns)
+    series = tf.keras.Input((IN_STEPS, n_features))
+    region = tf.keras.Input((), dtype='int32')
+    # Shape [batch] => [batch, time, embedding_size]
+    embedding = tf.keras.layers.Embedding(n_regions, embedding_size)(region)
+    embedding = tf.keras.layers.RepeatVector(IN_STEPS)(embedding)
+    inputs = tf.keras.layers.Concatenate()([series, embedding])
+    # the network of the method maps any number of input features to n_features
+    outputs = backend.create_model(n_features, OUT_STEPS)(inputs)
+    return tf.keras.Model([series, region], outputs)
+
+
+def make_dataset(windows, shuffle):
+    import tensorflow as tf
+
+    inputs = np.concatenate([w[0] for w in windows])
+    indices = np.concatenate([np.full(len(w[0]), w[2], dtype=np.int32) for w in windows])
+    labels = np.concatenate([w[1] for w in windows])
+    ds = tf.data.Dataset.from_tensor_slices(((inputs, indices), labels)).cache()
+    if shuffle:
+        ds = ds.shuffle(len(inputs))
+    return ds.batch(64).prefetch(tf.data.AUTOTUNE)
+
+
+def train_global_model(backend, base_method, region_cases, IN_STEPS, OUT_STEPS, model_dir):
+    """Train the model of base_method on absolute daily cases of all the regions and save it."""
+    from window_generator import WindowGenerator, compile_and_fit
+
+    window = WindowGenerator(IN_STEPS, OUT_STEPS, OUT_STEPS,
+                             pd.DataFrame(columns=daily_columns), None, None)
+    # every region gives its last days to the validation set
+    train, val = [], []
+    regions = {}
+    for region in sorted(region_cases):
+        daily = region_daily(region_cases[region], False)[daily_columns].to_numpy(dtype=float)
+        n_val = max(int(len(daily) * val_fraction), window.total_window_size)
+        if len(daily) < n_val + window.total_window_size:
+            continue
+        mean = daily.mean(axis=0)
+        std = daily.std(axis=0)
+        std[std == 0.] = 1.
+        daily = (daily - mean) / std
+        index = len(regions)
+        regions[region] = [index, mean.tolist(), std.tolist()]
+        train.append(window.make_windows(daily[:-n_val]) + (index,))
+        val.append(window.make_windows(daily[-n_val:]) + (index,))
+    if not regions:
+        raise GlobalModelError('no region has enough days to train the global model')
+
+    model = build_model(backend, len(regions), IN_STEPS, OUT_STEPS)
+    compile_and_fit(model, SimpleNamespace(train=make_dataset(train, True),
+                                           val=make_dataset(val, False)))
+
+    name = model_name(base_method, IN_STEPS, OUT_STEPS)
+    os.makedirs(model_dir, exist_ok=True)
+    tmp_weights = os.path.join(model_dir, 'tmp-%d-' % os.getpid() + name + '.weights.h5')
+    model.save_weights(tmp_weights)
+    os.replace(tmp_weights, weights_path(model_dir, name))
+    meta = {'regions': regions, 'version': '%x' % time.time_ns()}
+    tmp_meta = os.path.join(model_dir, 'tmp-%d-' % os.getpid() + name + '.json')
+    with open(tmp_meta, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    # the meta file is replaced last, it points predictions to the new weights
+    os.replace(tmp_meta, meta_path(model_dir, name))
+    return model
+
+
+def load_global_model(backend, base_method, IN_STEPS, OUT_STEPS, model_dir):
+    name = model_name(base_method, IN_STEPS, OUT_STEPS)
+    meta = read_meta(model_dir, name)
+    with models_lock:
+        loaded = models.get(name)
+        if loaded is None or loaded[0] != meta['version']:
+            model = build_model(backend, len(meta['regions']), IN_STEPS, OUT_STEPS)
+            model.load_weights(weights_path(model_dir, name))
+            loaded = models[name] = (meta['version'], model)
+    return loaded[1], meta
+
+
+def global_forecast(backend, base_method, forec_args, cases_list, forec_current_day, nonabs, populations,
+                    model_dir):
+    """Forecast all the region frames with one prediction of the global model.
+
+    Return a (prediction, error) pair for every region, predictions have the
+    columns of neural_forecast.
+    """
+    IN_STEPS = int(forec_args[2])
+    OUT_STEPS = int(forec_args[1])
+    model, meta = load_global_model(backend, base_method, IN_STEPS, OUT_STEPS, model_dir)
+
+    results = [None] * len(cases_list)
+    batch = []
+    for i, (cases, population) in enumerate(zip(cases_list, populations)):
+        region = cases['Place'].iloc[0]
+        scale = population if nonabs else 1.
+        df = region_daily(cases, forec_current_day, scale)
+        if region not in meta['regions']:
+            results[i] = (None, GlobalModelError('region %s is not known to the global model' % region))
+        elif len(df) < IN_STEPS:
+            results[i] = (None, GlobalModelError('%d days of %s are not enough for the global model'
+                                                 % (len(df), region)))
+        else:
+            batch.append((i, df, scale) + tuple(meta['regions'][region]))
+    if not batch:
+        return results
+
+    inputs = np.array([(df[daily_columns].to_numpy(dtype=float)[-IN_STEPS:] - mean) / std
+                       for _, df, _, _, mean, std in batch], dtype=np.float32)
+    indices = np.array([index for _, _, _, index, _, _ in batch], dtype=np.int32)
+    predictions = model.predict([inputs, indices], verbose=0)
+
+    for prediction, (i, df, scale, _, mean, std) in zip(predictions, batch):
+        prediction_df = pd.DataFrame(prediction * std + mean, columns=daily_columns)
+        time_max = pd.to_datetime(df.Date.max())
+        prediction_df.index = pd.date_range(time_max, periods=OUT_STEPS + 1, freq="D").drop(time_max)
+        last = df.loc[df.Date == df.Date.max()]
+        prediction_df['Confirmed'] = (prediction_df['Confirmed_daily'].cumsum()
+                                      + last['Confirmed'].values[0] * scale) / scale
+        prediction_df['Deaths'] = (prediction_df['Deaths_daily'].cumsum()
+                                   + last['Deaths'].values[0] * scale) / scale
+        results[i] = (prediction_df, None)
+    return results
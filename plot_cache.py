@@ -0,0 +1,102 @@
+import fcntl
+import hashlib
+import json
+import os
+import uuid
+
+from file_cache import FileCache
+
+
+def normalize_forecast(forec_args):
+    if not forec_args:
+        return []
+    periods = [str(int(x)) if str(x).strip().isdigit() else str(x) for x in forec_args[1:]]
+    return [str(forec_args[0])] + periods
+
+
+def normalize_args(args):
+    """Return plot parameters in a canonical form, equal plots give equal dicts."""
+    return {'regions': sorted(set(args.regions)),
+            'nonlog': bool(args.nonlog),
+            'daily': bool(args.daily),
+            'deaths': bool(args.deaths),
+            'nonabs': bool(args.nonabs),
+            'current_day': bool(args.current_day),
+            'forec_current_day': bool(args.forec_current_day),
+            'from_date': str(args.from_date) if args.from_date else '',
+            'forec_confirmed': normalize_forecast(args.forec_confirmed),
+            'forec_deaths': normalize_forecast(args.forec_deaths)}
+
+
+class PlotCache(FileCache):
+    """Directory of rendered plots with a size cap and LRU eviction.
+
+    File names are derived from the normalized plot parameters and the data
+    version, so a plot is rendered again only when the data changes.
+
+    `render` lets only one thread of one process render a missing plot,
+    concurrent requests for the same key wait for it and get the file.
+    An incomplete plot, e.g. with a failed forecast, is not cached: it is
+    kept under a name of its own and the next request renders it again.
+    """
+
+    suffix = '.png'
+
+    def __init__(self, directory, max_entries=2000, max_bytes=256 * 2 ** 20):
+        super().__init__(directory, max_entries, max_bytes)
+
+    def key(self, args, data_version):
+        params = json.dumps([normalize_args(args), data_version], sort_keys=True)
+        m = hashlib.md5()
+        m.update(params.encode('ascii', 'backslashreplace'))
+        return m.hexdigest()
+
+    @staticmethod
+    def locked_file(lock_path):
+        """Open and lock lock_path, the owner of the lock removes the file before unlocking it."""
+        while True:
+            lock_file = open(lock_path, 'a')
+            # flock locks of separate opens exclude threads of one process too
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # the file could be removed by the previous owner while we were waiting
+                if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+
+    def render(self, key, render_plot):
+        """Make sure the plot for key exists, call render_plot(file_name) if not.
+
+        render_plot returns False if the plot is incomplete. Return the file
+        name of the plot and True if it was rendered by this call.
+        """
+        if self.lookup(key):
+            return self.file_name(key), False
+
+        # a file lock of the key for threads and worker processes, the render
+        # can wait for forecasts, so other plots do not wait for it
+        lock_path = os.path.join(self.directory, '.lock-' + key)
+        with self.locked_file(lock_path) as lock_file:
+            try:
+                # the plot could be rendered while we were waiting
+                if os.path.isfile(self.path(key)):
+                    return self.file_name(key), False
+                tmp_path = self.tmp_path(key)
+                try:
+                    complete = render_plot(tmp_path) is not False
+                    size = os.path.getsize(tmp_path)
+                    if not complete:
+                        key = '%s-%s' % (key, uuid.uuid4().hex)
+                    os.replace(tmp_path, self.path(key))
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+            finally:
+                # the next render of the key locks a new file
+                os.remove(lock_path)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        self.evict(size)
+        return self.file_name(key), True
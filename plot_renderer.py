@@ -0,0 +1,141 @@
+# Agg renderer of the plots of the web service. Every thread keeps one
+# styled figure with its axes and draws the lines of a request with
+# Axes.plot on numpy arrays, without pandas plotting and pyplot. The layout
+# of the figure is fixed, so saving does not measure the text extents.
+
+import threading
+
+import matplotlib
+import matplotlib.dates as mdates
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from process_procedures import is_neural
+
+dpi = 150
+# fits the axis labels and the tick labels of the y axes, the right one
+# is set aside for the axis of the daily cases; the top one fits the title
+# above the offset labels of the axes, e.g. 1e7 of linear totals
+margins = {'left': 0.14, 'right': 0.95, 'bottom': 0.08, 'top': 0.89}
+daily_right = 0.85
+
+templates = threading.local()
+
+
+class PlotTemplate:
+    """Figure with the axes of the plot, the lines are replaced by every render."""
+
+    def __init__(self):
+        self.figure = Figure(dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.figure.subplots_adjust(**margins)
+        self.ax1 = self.figure.add_subplot()
+        self.ax2 = self.ax1.twinx()
+        for ax in [self.ax1, self.ax2]:
+            # the lines end at the first and the last dates, as pandas draws them
+            ax.set_xmargin(0.)
+        locator = mdates.AutoDateLocator()
+        self.ax1.xaxis.set_major_locator(locator)
+        self.ax1.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+        self.colors = matplotlib.rcParams['axes.prop_cycle'].by_key()['color']
+
+    def clear(self):
+        for ax in [self.ax1, self.ax2]:
+            for line in list(ax.lines):
+                line.remove()
+            ax.grid(False)
+            ax.set_yscale('linear')
+            ax.relim()
+            ax.set_autoscale_on(True)
+        legend = self.ax1.get_legend()
+        if legend is not None:
+            legend.remove()
+
+
+def get_template():
+    template = getattr(templates, 'template', None)
+    if template is None:
+        template = templates.template = PlotTemplate()
+    return template
+
+
+def plot_forecast(forec_args, prediction_df, field_name, ax1, ax2, color, isDaily):
+    # draws as forecast in process_procedures
+    if field_name == 'Deaths':
+        style = dict(linestyle='--', lw=1.05, marker=2., markersize=1.75)
+    else:
+        style = dict(linestyle='-', lw=1.05, marker='o', markersize=1.35)
+
+    # the x axis is scaled to the forecasted dates with the other lines
+    forec_dates = mdates.date2num(prediction_df.index.to_numpy())
+    ax1.plot(forec_dates, prediction_df[field_name].to_numpy(), color=color, **style)
+
+    if is_neural(forec_args[0]) and isDaily and field_name == 'Confirmed':
+        ax2.plot(forec_dates, prediction_df[field_name + '_daily'].to_numpy(), linestyle='-', lw=0.15,
+                 color=color, marker='s', markersize=2)
+
+
+def render_plot(args, regions, region_cases, predictions, countries_params, plot_file_name):
+    """Draw the plot of process into plot_file_name, see process_procedures.draw_plot."""
+    template = get_template()
+    template.clear()
+    ax1, ax2 = template.ax1, template.ax2
+
+    title = 'Подтвержденные (—)'
+    if args.daily:
+        title += ' и новые (▪)'
+    title += ' случаи'
+    if args.deaths or args.forec_deaths:
+        title += ', смерти (---)'
+    ax1.set_title(title)
+
+    handles = []
+    for i, region in enumerate(regions):
+        color = template.colors[i % len(template.colors)]
+        df = region_cases[region]
+        x = mdates.date2num(df['Date'].to_numpy())
+
+        handles += ax1.plot(x, df['Confirmed'].to_numpy(), linestyle='-', lw=2.1, color=color,
+                            marker='o', markersize=2.7, label=countries_params[region]['country_ru'])
+
+        if args.daily:
+            ax2.plot(x, df['Confirmed_daily'].to_numpy(), linestyle='-', lw=0.3, color=color,
+                     marker='s', markersize=4)
+
+        if args.deaths or args.forec_deaths:
+            ax1.plot(x, df['Deaths'].to_numpy(), linestyle='--', lw=2.1, color=color,
+                     marker=2, markersize=3.5)
+
+        if args.forec_confirmed and predictions[region, 'Confirmed'] is not None:
+            plot_forecast(args.forec_confirmed, predictions[region, 'Confirmed'], 'Confirmed',
+                          ax1, ax2, color, args.daily)
+
+        if args.forec_deaths and predictions[region, 'Deaths'] is not None:
+            plot_forecast(args.forec_deaths, predictions[region, 'Deaths'], 'Deaths',
+                          ax1, ax2, color, args.daily)
+
+    legend = ax1.legend(handles=handles)
+    for handle in legend.legendHandles:
+        handle.set_linewidth(5.0)
+
+    if args.nonabs:
+        ax1.set_ylabel('Всего (доля населения)')
+    else:
+        ax1.set_ylabel('Всего (человек)')
+
+    ax2.set_visible(bool(args.daily))
+    template.figure.subplots_adjust(right=daily_right if args.daily else margins['right'])
+    if args.daily:
+        ax2.set_ylabel('Новые случаи (человек)')
+
+    if args.from_date:
+        ax1.set_xlim(xmin=mdates.date2num(np.datetime64(args.from_date)))
+
+    if not args.nonlog:
+        ax1.set_yscale('log')
+
+    # the grid follows the ticks of the secondary axis when it is drawn
+    (ax2 if args.daily else ax1).grid(True)
+
+    template.figure.savefig(plot_file_name, dpi=dpi)
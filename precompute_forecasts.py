@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Trains the global neural models and computes the default forecasts of
+# the web form for every country and World and puts them into the forecast
+# store, so web requests only render.
+# Run it after the data update, e.g. python3 covid_plot.py --precompute
+
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import process_procedures
+from process_procedures import preprocess, aggregate_params, split_regions, forecast_all
+from forecast_store import ForecastStore
+
+# methods and windows offered by the web form by default
+default_methods = ['linear', 'poly', 'cnn', 'ldm', 'cnn_global', 'ldm_global']
+default_forward = 7
+default_backward = 7
+
+# plot parameters of the web form the forecasts are computed for
+default_args = SimpleNamespace(current_day=False, forec_current_day=[], nonabs=False)
+
+
+def precompute_forecasts(cases, cases_today, countries_params, store, methods=default_methods,
+                         forward=default_forward, backward=default_backward, n_jobs=1):
+    places_params = aggregate_params(countries_params)
+    places = sorted(set(places_params) & set(cases['Place']))
+    region_cases, populations = split_regions(default_args, cases, cases_today, places_params, places)
+    regions = sorted(set(countries_params) & set(places))
+
+    # global models are retrained on the new data before their forecasts
+    for method in methods:
+        if method in process_procedures.global_methods:
+            train_global(method, region_cases, forward, backward)
+
+    for method in methods:
+        forec_args = [method, str(forward), str(backward)]
+        jobs = [(forec_args, region, field_name)
+                for region in regions for field_name in ['Confirmed', 'Deaths']]
+        start = time.time()
+        predictions = forecast_all(jobs, region_cases, populations, default_args.forec_current_day,
+                                   default_args.nonabs, store=store, n_jobs=n_jobs,
+                                   raise_errors=False)
+        failed = sum(prediction is None for prediction in predictions)
+        print('%s: %d regions in %.1f s, %d of %d forecasts failed'
+              % (method, len(regions), time.time() - start, failed, len(jobs)), file=sys.stderr)
+
+
+def train_global(method, region_cases, forward, backward):
+    from global_forecast import train_global_model
+
+    base_method = process_procedures.global_methods[method]
+    start = time.time()
+    try:
+        train_global_model(process_procedures.neural_backend(base_method), base_method, region_cases,
+                           backward, forward, process_procedures.global_model_dir)
+    except Exception as e:
+        print('%s: training failed: %s' % (method, e), file=sys.stderr)
+        return
+    print('%s: trained on %d regions in %.1f s' % (method, len(region_cases), time.time() - start),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    covid_data_path = "COVID-19/data"
+    cases_file = "cases_time.csv"
+    cases_today_file = "cases_country.csv"
+    snapshot_path = "state/snapshot"
+
+    with open(os.path.join('data', 'countries_params.json'), 'r', encoding='utf-8') as f:
+        countries_params = json.load(f)
+
+    cases, cases_today = preprocess(None, covid_data_path, cases_file, cases_today_file,
+                                    snapshot_path=snapshot_path, countries_params=countries_params)
+    precompute_forecasts(cases, cases_today, countries_params, ForecastStore('state/forecasts'),
+                         methods=sys.argv[1:] or default_methods, n_jobs=os.cpu_count())
@@ -3,36 +3,312 @@ import sys
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from scipy.optimize import curve_fit
-import cnn_forecast_methods  as cnn
-import ldm_forecast_methods as ldm
+import importlib
+import io
+from snapshot import (load_snapshot, build_snapshot, read_current_meta, load_table, file_md5, read_tail,
+                      date_blocks, merge_blocks, last_dates)
+from forecast_store import series_version, forecast_key
+from concurrent.futures import ProcessPoolExecutor
+from fitting import func_linear, func_poly, func_covid, fit_curve, fit_polynomial_batch, poly_degrees
+
+# forecast methods: fitted functions and modules with fit_model of neural networks
+forecast_functions = {'linear': func_linear, 'poly': func_poly, 'covid': func_covid}
+neural_methods = {'cnn': 'cnn_forecast_methods', 'ldm': 'ldm_forecast_methods'}
+# models trained on all the regions at once with the networks of neural_methods
+global_methods = {'cnn_global': 'cnn', 'ldm_global': 'ldm'}
+global_model_dir = os.path.join('state', 'models')
+
+
+class NoRegionsError(Exception):
+    pass
+
+
+def neural_backend(func_type):
+    # neural backends import tensorflow, so they are loaded on first use only
+    return importlib.import_module(neural_methods[func_type])
+
+
+# client of forecast_worker.py; when set, neural models are trained there
+neural_worker = None
+
+
+def neural_forecast(forec_args, cases, forec_current_day, nonabs, population):
+    if neural_worker is not None:
+        return neural_worker.forecast(forec_args, cases, forec_current_day, nonabs, population)
+
+    df = cases.copy(deep=True)
+    if not forec_current_day:
+        df.drop(df[df.Date == df.Date.max()].index, inplace=True)
+
+    Confirmed_current = df.loc[df.Date == df.Date.max()]['Confirmed'].values[0]
+    Deaths_current = df.loc[df.Date == df.Date.max()]['Deaths'].values[0]
+    if nonabs:
+        Confirmed_current *= population
+        Deaths_current *= population
 
+    limit = 10000.
+    if nonabs:
+        limit /= population
 
-def func_linear(x, a, b):
-    return a * x + b
+    df.drop(df[df.Confirmed < limit].index, inplace=True)
+    df.drop(columns=['Place', 'Confirmed', 'Deaths'], inplace=True)
+    date_time = pd.to_datetime(df.pop('Date'), format='%Y.%m.%d')
 
+    train_df = df[0:int(len(df) * 0.7)]
+    val_df = df[int(len(df) * 0.7):int(len(df) * 0.9)]
+    test_df = df[int(len(df) * 0.9):]
+    mean = train_df.mean()
+    std = train_df.std()
+    df = (df - mean) / std
+    train_df = (train_df - mean) / std
+    val_df = (val_df - mean) / std
+    test_df = (test_df - mean) / std
 
-def func_poly(x, a, b, c, d):
-    return a * x ** 3 + b * x ** 2 + c * x + d
+    IN_STEPS = int(forec_args[2])
+    OUT_STEPS = int(forec_args[1])
 
+    model, window = neural_backend(forec_args[0]).fit_model(train_df, val_df, test_df,
+                                                            IN_STEPS, OUT_STEPS)
 
-def func_covid(x, a, b, c, d):
-    return (a * x + b) * np.exp(c / x + d)
+    prediction = model(np.array([df[- OUT_STEPS:]]))
+    prediction_df = pd.DataFrame(prediction.numpy()[0])
+    prediction_df.columns = df.columns
+    df.index = date_time
+    time_max = date_time[-OUT_STEPS:].max()
+    prediction_time = pd.date_range(time_max, periods=OUT_STEPS + 1, freq="D")
+    prediction_time = prediction_time.drop(time_max)
+    prediction_df.index = prediction_time
+    prediction_df = prediction_df * std + mean
+    prediction_df['Confirmed'] = prediction_df['Confirmed_daily'].cumsum() + Confirmed_current
+    prediction_df['Deaths'] = prediction_df['Deaths_daily'].cumsum() + Deaths_current
+    if nonabs:
+        prediction_df['Confirmed'] /= population
+        prediction_df['Deaths'] /= population
 
+    return prediction_df
 
-def forecast(forec_args, cases, field_name, ax, color, forec_current_day, isDaily, nonabs, population):
+
+def global_forecast_batch(forec_args, cases_list, forec_current_day, nonabs, populations):
+    """Forecasts of many regions by the global model, a (prediction, error) pair per region."""
+    if neural_worker is not None:
+        return neural_worker.forecast_global(forec_args, cases_list, forec_current_day, nonabs, populations)
+    base_method = global_methods[forec_args[0]]
+    return importlib.import_module('global_forecast').global_forecast(
+        neural_backend(base_method), base_method, forec_args, cases_list, forec_current_day, nonabs,
+        populations, global_model_dir)
+
+
+def global_model_version(forec_args):
+    # forecasts of a retrained model are new forecasts; without a model the forecast fails later
+    try:
+        return importlib.import_module('global_forecast').model_version(
+            global_model_dir, global_methods[forec_args[0]], int(forec_args[2]), int(forec_args[1]))
+    except Exception:
+        return ''
+
+
+def is_neural(func_type):
+    # neural forecasts predict all the fields at once
+    return func_type in neural_methods or func_type in global_methods
+
+
+def forecast_window(forec_args, cases, field_name, forec_current_day):
+    """Return days and values to fit and days to forecast for curve fitting."""
+    forward = np.timedelta64(int(forec_args[1]), 'D')
+    backward = np.timedelta64(int(forec_args[2]), 'D')
+
+    # import time, confirmed cases and deaths form pandas to numpy
+    date = cases.Date.to_numpy()
+    value = cases[field_name].to_numpy()
+
+    # trim data for particular purposes of forecast
+    date_current = date[-1]
+    date_forward = date_current + forward
+    date_backward = date_current - backward
+
+    date_range_forecast = np.arange(date_backward, date_forward, dtype='datetime64[D]')
+
+    # set time frame for curve fitting for confirmed cases
+    backward_condition = date > date_backward
+    if not forec_current_day:
+        backward_condition[-1] = False  # the last day is not use since can be non filled
+    date_range_fitting = date[backward_condition].astype('datetime64[D]')
+    value = value[backward_condition]
+
+    return date_range_fitting, value, date_range_forecast
+
+
+def forecast_frame(date_range_forecast, field_name, value):
+    forecast_value = pd.DataFrame(index=pd.DatetimeIndex(date_range_forecast.astype('datetime64[ns]')))
+    forecast_value[field_name] = value
+    return forecast_value
+
+
+def curve_forecast(forec_args, cases, field_name, forec_current_day, warm_start=None):
+    """Return the curve forecast and the parameters of a covid fit, see fitting.fit_curve."""
+    date_range_fitting, value, date_range_forecast = forecast_window(forec_args, cases, field_name,
+                                                                     forec_current_day)
+
+    # fit on days since epoch
+    func, params = fit_curve(forec_args[0], date_range_fitting.astype(float), value, warm_start)
+
+    return forecast_frame(date_range_forecast, field_name, func(date_range_forecast.astype(int))), params
+
+
+def curve_forecast_batch(forec_args, cases_list, field_name, forec_current_day):
+    """Linear or poly forecasts of many regions with the same days, fitted at once."""
+    windows = [forecast_window(forec_args, cases, field_name, forec_current_day) for cases in cases_list]
+    date_range_fitting, _, date_range_forecast = windows[0]
+    values = np.array([value for _, value, _ in windows], dtype=float)
+
+    _, func = fit_polynomial_batch(date_range_fitting.astype(float), values, poly_degrees[forec_args[0]])
+    curves = func(date_range_forecast.astype(int))
+    return [forecast_frame(date_range_forecast, field_name, curve) for curve in curves]
+
+
+def check_forecast_method(forec_args):
+    if forec_args[0] not in forecast_functions and not is_neural(forec_args[0]):
+        print('No such function type, use covid, poly, linear, cnn, ldm, cnn_global or ldm_global',
+              file=sys.stderr)
+        sys.exit(-1)
+
+
+def compute_forecast(forec_args, cases, field_name, forec_current_day, nonabs, population, warm_start=None):
+    """Return the prediction and the fitted parameters of a covid forecast, None for other methods."""
+    if forec_args[0] in global_methods:
+        prediction, error = global_forecast_batch(forec_args, [cases], forec_current_day, nonabs,
+                                                  [population])[0]
+        if error is not None:
+            raise error
+        return prediction, None
+    if forec_args[0] in neural_methods:
+        return neural_forecast(forec_args, cases, forec_current_day, nonabs, population), None
+    return curve_forecast(forec_args, cases, field_name, forec_current_day, warm_start)
+
+
+def compute_forecast_or_error(*params):
+    try:
+        prediction, fit_params = compute_forecast(*params)
+        return prediction, None, fit_params
+    except Exception as e:
+        return None, e, None
+
+
+def forecast_all(jobs, region_cases, populations, forec_current_day, nonabs, store=None, n_jobs=1,
+                 raise_errors=True):
+    """Return forecasts for a list of (forec_args, region, field_name) jobs.
+
+    Every forecast is a DataFrame indexed by date. Neural forecasts predict
+    all the fields at once, curve fitting gives only field_name, so equal
+    neural jobs for both fields are computed once. Forecasts missing in the
+    store are computed in a pool of n_jobs processes and stored. Covid fits
+    start from the parameters of the last stored fit of the region, whatever
+    data it was fitted to. Without
+    raise_errors a failed forecast is reported to stderr and returned as None.
+    """
+    model_versions = {tuple(forec_args): global_model_version(forec_args)
+                      for forec_args, _, _ in jobs if forec_args[0] in global_methods}
+    keys = [forecast_key(region, forec_args[0], [int(x) for x in forec_args[1:]],
+                         forec_current_day,
+                         series_version(region_cases[region]) + model_versions.get(tuple(forec_args), ''),
+                         None if is_neural(forec_args[0]) else field_name)
+            for forec_args, region, field_name in jobs]
+    # parameters of covid fits are kept without the data digest for the next day data
+    warm_keys = [forecast_key(region, forec_args[0], [int(forec_args[2])], forec_current_day,
+                              None, field_name)
+                 if forec_args[0] == 'covid' else None
+                 for forec_args, region, field_name in jobs]
+
+    predictions = {}
+    missing = {}
+    missing_warm_keys = {}
+    for key, warm_key, (forec_args, region, field_name) in zip(keys, warm_keys, jobs):
+        if key in predictions or key in missing:
+            continue
+        prediction = store.get(key) if store is not None else None
+        if prediction is not None:
+            predictions[key] = prediction
+        else:
+            warm_start = store.get_params(warm_key) if store is not None and warm_key else None
+            missing[key] = (forec_args, region_cases[region], field_name,
+                            forec_current_day, nonabs, populations[region], warm_start)
+            missing_warm_keys[key] = warm_key
+
+    computed = {}
+
+    # linear and poly fits over the same days are solved at once for all regions
+    batches = {}
+    for key, params in missing.items():
+        forec_args, cases, field_name = params[:3]
+        if forec_args[0] in poly_degrees:
+            date_range_fitting, _, date_range_forecast = forecast_window(forec_args, cases, field_name,
+                                                                         forec_current_day)
+            batch = (tuple(forec_args), field_name,
+                     date_range_fitting.tobytes(), date_range_forecast.tobytes())
+            batches.setdefault(batch, []).append(key)
+    for (forec_args, field_name, _, _), keys_batch in batches.items():
+        if len(keys_batch) < 2:
+            continue
+        try:
+            curves = curve_forecast_batch(list(forec_args), [missing[key][1] for key in keys_batch],
+                                          field_name, forec_current_day)
+            computed.update((key, (curve, None, None)) for key, curve in zip(keys_batch, curves))
+        except Exception:
+            # the regions are fitted one by one then
+            pass
+
+    # the global model predicts all the regions with the same windows at once
+    global_batches = {}
+    for key, params in missing.items():
+        if params[0][0] in global_methods:
+            global_batches.setdefault(tuple(params[0]), []).append(key)
+    for forec_args, keys_batch in global_batches.items():
+        try:
+            results = global_forecast_batch(list(forec_args), [missing[key][1] for key in keys_batch],
+                                            forec_current_day, nonabs,
+                                            [missing[key][5] for key in keys_batch])
+        except Exception as e:
+            results = [(None, e)] * len(keys_batch)
+        computed.update((key, (prediction, error, None))
+                        for key, (prediction, error) in zip(keys_batch, results))
+
+    remaining = [key for key in missing if key not in computed]
+
+    # fitting and training are independent for every job and CPU-bound
+    if n_jobs > 1 and len(remaining) > 1:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(remaining))) as pool:
+            computed.update(zip(remaining, pool.map(compute_forecast_or_error,
+                                                    *zip(*[missing[key] for key in remaining]))))
+    else:
+        computed.update((key, compute_forecast_or_error(*missing[key])) for key in remaining)
+
+    for key, params in missing.items():
+        prediction, error, fit_params = computed[key]
+        if error is not None:
+            if raise_errors:
+                raise error
+            print('Forecast', params[0], params[1]['Place'].iloc[0], params[2], 'failed:', error,
+                  file=sys.stderr)
+        elif store is not None:
+            store.put(key, prediction, fit_params, missing_warm_keys[key])
+        predictions[key] = prediction
+
+    return [predictions[key] for key in keys]
+
+
+def forecast_values(forec_args, cases, field_name, forec_current_day, nonabs, population,
+                    region=None, store=None):
+    """Return the forecast of one region, see forecast_all."""
+    return forecast_all([(forec_args, region, field_name)], {region: cases}, {region: population},
+                        forec_current_day, nonabs, store=store)[0]
+
+
+def forecast(forec_args, cases, field_name, ax, color, forec_current_day, isDaily, nonabs, population,
+             region=None, store=None, prediction_df=None):
     # set function type for curve fitting
 
     func_type = forec_args[0]
-    if func_type == 'linear':
-        func = func_linear
-    elif func_type == 'poly':
-        func = func_poly
-    elif func_type == 'covid':
-        func = func_covid
-    elif func_type != 'cnn' and func_type != 'ldm':
-        print('No such function type, use covid, poly or linear', file=sys.stderr)
-        sys.exit(-1)
+    check_forecast_method(forec_args)
 
     lw = 1.05
     marker = 'o'
@@ -44,97 +320,20 @@ def forecast(forec_args, cases, field_name, ax, color, forec_current_day, isDail
         marker = 2.
         markersize = 1.75
 
-    if func_type != 'cnn' and func_type != 'ldm':
-        forward = np.timedelta64(int(forec_args[1]), 'D')
-        backward = np.timedelta64(int(forec_args[2]), 'D')
-
-        # import time, confirmed cases and deaths form pandas to numpy
-        date = cases.Date.to_numpy()
-        value = cases[field_name].to_numpy()
+    if prediction_df is None:
+        prediction_df = forecast_values(forec_args, cases, field_name, forec_current_day, nonabs,
+                                        population, region=region, store=store)
 
-        # trim data for particular purposes of forecast
-        date_current = date[-1]
-        date_forward = date_current + forward
-        date_backward = date_current - backward
-
-        date_range_forecast = np.arange(date_backward, date_forward, dtype='datetime64[D]')
+    if not is_neural(func_type):
+        date_forward = cases.Date.to_numpy()[-1] + np.timedelta64(int(forec_args[1]), 'D')
         ax.set_xlim(xmax=date_forward)
 
-        # set time frame for curve fitting for confirmed cases
-        backward_condition = date > date_backward
-        if not forec_current_day:
-            backward_condition[-1] = False  # the last day is not use since can be non filled
-        date_range_fitting = date[backward_condition]
-        value = value[backward_condition]
-
-        # employ numpy curve fitting for forecast
-        popt, pcov = curve_fit(func, date_range_fitting.astype('datetime64[D]').astype(float),
-                               value, maxfev=int(1.e+9))
-
-        # plot forecast
-        forecast_value = pd.DataFrame()
-        forecast_value['Date'] = date_range_forecast.astype('datetime64[ns]')
-        forecast_value[field_name] = func(
-            date_range_forecast.astype('datetime64[D]').astype(int), *popt)
-        forecast_value.Date = forecast_value.Date.dt.normalize()
-
-        forecast_value.plot(x='Date', y=field_name, linestyle=linestyle, lw=lw, color=color,
-                            ax=ax, label='', marker=marker, markersize=markersize)
+        prediction_df.plot(y=field_name, linestyle=linestyle, lw=lw, color=color,
+                           ax=ax, label='', marker=marker, markersize=markersize)
 
         if np.datetime64(int(ax.get_xlim()[1]), 'D') < date_forward:
             ax.set_xlim(xmax=date_forward)
     else:
-        df = cases.copy(deep=True)
-        if not forec_current_day:
-            df.drop(df[df.Date == df.Date.max()].index, inplace=True)
-
-        Confirmed_current = df.loc[df.Date == df.Date.max()]['Confirmed'].values[0]
-        Deaths_current = df.loc[df.Date == df.Date.max()]['Deaths'].values[0]
-        if nonabs:
-            Confirmed_current *= population
-            Deaths_current *= population
-
-        limit = 10000.
-        if nonabs:
-            limit /= population
-
-        df.drop(df[df.Confirmed < limit].index, inplace=True)
-        df.drop(columns=['Place', 'Confirmed', 'Deaths'], inplace=True)
-        date_time = pd.to_datetime(df.pop('Date'), format='%Y.%m.%d')
-
-        train_df = df[0:int(len(df) * 0.7)]
-        val_df = df[int(len(df) * 0.7):int(len(df) * 0.9)]
-        test_df = df[int(len(df) * 0.9):]
-        mean = train_df.mean()
-        std = train_df.std()
-        df = (df - mean) / std
-        train_df = (train_df - mean) / std
-        val_df = (val_df - mean) / std
-        test_df = (test_df - mean) / std
-
-        IN_STEPS = int(forec_args[2])
-        OUT_STEPS = int(forec_args[1])
-        
-        if func_type == 'cnn':
-            model, window = cnn.fit_model(train_df, val_df, test_df, IN_STEPS, OUT_STEPS)
-        elif func_type == 'ldm':
-            model, window = ldm.fit_model(train_df, val_df, test_df, IN_STEPS, OUT_STEPS)
-
-        prediction = model(np.array([df[- OUT_STEPS:]]))
-        prediction_df = pd.DataFrame(prediction.numpy()[0])
-        prediction_df.columns = df.columns
-        df.index = date_time
-        time_max = date_time[-OUT_STEPS:].max()
-        prediction_time = pd.date_range(time_max, periods=OUT_STEPS + 1, freq="D")
-        prediction_time = prediction_time.drop(time_max)
-        prediction_df.index = prediction_time
-        prediction_df = prediction_df * std + mean
-        prediction_df['Confirmed'] = prediction_df['Confirmed_daily'].cumsum() + Confirmed_current
-        prediction_df['Deaths'] = prediction_df['Deaths_daily'].cumsum() + Deaths_current
-        if nonabs:
-            prediction_df['Confirmed'] /= population
-            prediction_df['Deaths'] /= population
-
         prediction_df.plot(y=field_name, linestyle=linestyle, lw=lw, color=color,
                            ax=ax, label='', marker=marker, markersize=markersize)
 
@@ -143,81 +342,334 @@ def forecast(forec_args, cases, field_name, ax, color, forec_current_day, isDail
                                ax=ax, label='', marker='s', markersize=2)
 
 
-def preprocess(args, covid_data_path, cases_file, cases_today_file):
-    useful_columns = ['Country_Region', 'Last_Update', 'Confirmed', 'Deaths']
-    rename_dict = {'Country_Region': 'Place', 'Last_Update': 'Date'}
+useful_columns = ['Country_Region', 'Last_Update', 'Confirmed', 'Deaths']
+rename_dict = {'Country_Region': 'Place', 'Last_Update': 'Date'}
+# only these columns are parsed; counts are float, as some of them are missing
+source_dtypes = {'UID': 'float64', 'Country_Region': 'category', 'Last_Update': 'object',
+                 'Confirmed': 'float64', 'Deaths': 'float64'}
+# rows of cases_time.csv parsed at once, memory of the parse does not grow with the file
+chunk_rows = 200000
 
-    cases_raw = pd.read_csv(os.path.join(covid_data_path, cases_file), low_memory=False)
 
+def sum_chunk(cases_raw, date_shift=None):
     # remove USA states
     cases_raw = cases_raw[cases_raw['UID'] != 840]
     cases = pd.DataFrame(cases_raw[useful_columns])
     cases.rename(columns=rename_dict, inplace=True)
-    cases['Date'] = pd.to_datetime(cases['Date']).dt.normalize()
-    cases = cases.groupby(['Date', 'Place']).sum().reset_index()
-    cases = cases.sort_values(by=['Place', 'Date'])
+    cases['Date'] = pd.to_datetime(cases['Date'])
+    cases['Date'] = cases['Date'].dt.normalize() if date_shift is None else cases['Date'] - date_shift
+    return cases.groupby(['Date', 'Place'], observed=True)[['Confirmed', 'Deaths']].sum()
+
+
+def sum_chunks(sums):
+    # a (date, place) can be split between chunks, missing counts are summed as 0
+    cases = pd.concat(sums).groupby(level=['Date', 'Place'], observed=True).sum().reset_index()
+    cases['Place'] = cases['Place'].astype(str).astype(object)
+    cases[['Confirmed', 'Deaths']] = cases[['Confirmed', 'Deaths']].astype(np.int64)
+    return cases.sort_values(by=['Place', 'Date'])
+
+
+def parse_cases(source):
+    # source is a path or a buffer with the CSV header
+    with pd.read_csv(source, usecols=list(source_dtypes), dtype=source_dtypes,
+                     chunksize=chunk_rows) as chunks:
+        return sum_chunks([sum_chunk(chunk) for chunk in chunks])
+
+
+def parse_cases_today(source):
+    cases_today_raw = pd.read_csv(source, usecols=list(source_dtypes), dtype=source_dtypes)
+    return sum_chunks([sum_chunk(cases_today_raw, date_shift=np.timedelta64(1, 'D'))])
+
+
+def read_cases(covid_data_path, cases_file, cases_today_file):
+    return (parse_cases(os.path.join(covid_data_path, cases_file)),
+            parse_cases_today(os.path.join(covid_data_path, cases_today_file)))
+
+
+aggregate_names_ru = {
+    'Africa': 'Африка',
+    'Americas': 'Америка',
+    'Asia': 'Азия',
+    'Europe': 'Европа',
+    'Oceania': 'Океания',
+    'Australia and New Zealand': 'Австралия и Новая Зеландия',
+    'Central Asia': 'Центральная Азия',
+    'Eastern Asia': 'Восточная Азия',
+    'Eastern Europe': 'Восточная Европа',
+    'Latin America and the Caribbean': 'Латинская Америка и Карибский бассейн',
+    'Melanesia': 'Меланезия',
+    'Northern Africa': 'Северная Африка',
+    'Northern America': 'Северная Америка',
+    'Northern Europe': 'Северная Европа',
+    'South-eastern Asia': 'Юго-Восточная Азия',
+    'Southern Asia': 'Южная Азия',
+    'Southern Europe': 'Южная Европа',
+    'Sub-Saharan Africa': 'Африка южнее Сахары',
+    'Western Asia': 'Западная Азия',
+    'Western Europe': 'Западная Европа',
+}
+
+
+def aggregate_members(countries_params):
+    # countries of every region and subregion from countries_params
+    members = {}
+    for country, params in countries_params.items():
+        for key in ['region', 'subregion']:
+            name = params.get(key)
+            if name in aggregate_names_ru:
+                members.setdefault(name, []).append(country)
+    return members
+
+
+def aggregate_params(countries_params):
+    """Return countries_params extended with the regions and subregions."""
+    params_all = dict(countries_params)
+    for name, countries in aggregate_members(countries_params).items():
+        params_all[name] = {'country_ru': aggregate_names_ru[name],
+                            'population': sum(countries_params[country]['population']
+                                              for country in countries),
+                            'region': name, 'subregion': name}
+    return params_all
+
+
+def sum_places(cases, name, single_date=False):
+    if single_date:
+        # rows of the current day can have slightly different update times
+        cases = cases.assign(Date=cases['Date'].max())
+    aggregate = cases.groupby(['Date'])[['Confirmed', 'Deaths']].sum().reset_index()
+    aggregate.insert(1, 'Place', name)
+    return aggregate
+
+
+def add_aggregates(cases, countries_params, single_date=False):
+    """Append World and per region/subregion sums, which are not in cases yet."""
+    places = set(cases['Place'])
+    frames = [cases]
+    if 'World' not in places:
+        frames.append(sum_places(cases, 'World', single_date))
+    for name, countries in aggregate_members(countries_params).items():
+        members = cases[cases['Place'].isin(countries)]
+        # regions without data stay missing, as countries without data
+        if name not in places and len(members):
+            frames.append(sum_places(members, name, single_date))
+    if len(frames) == 1:
+        return cases
+    return pd.concat(frames, ignore_index=True)
+
+
+def aggregate_places(countries_params):
+    return {'World'} | set(aggregate_members(countries_params))
+
+
+def compact_frame(df, dtypes):
+    # frames of the snapshot already have the schema and stay mapped, astype would copy them
+    changed = {column: dtype for column, dtype in dtypes.items() if df[column].dtype != dtype}
+    return df.astype(changed) if changed else df
+
+
+def compact_tables(cases, cases_today, countries_params=None):
+    """Return cases and cases_today in the compact schema shared by the whole pipeline.
+
+    Place is categorical over the places of countries_params and of the data,
+    the same for both tables, counts are int32.
+    """
+    places = set(countries_params or []) | set(cases['Place']) | set(cases_today['Place'])
+    dtypes = {'Place': pd.CategoricalDtype(sorted(places)), 'Confirmed': np.int32, 'Deaths': np.int32}
+    return compact_frame(cases, dtypes), compact_frame(cases_today, dtypes)
+
+
+def prepare_tables(cases, cases_today, countries_params=None):
+    # aggregates are computed once per data update and kept in the snapshot
+    if countries_params is not None:
+        cases = add_aggregates(cases, countries_params)
+        cases_today = add_aggregates(cases_today, countries_params, single_date=True)
+    return compact_tables(cases, cases_today, countries_params)
+
+
+def append_cases(cases, new_cases, countries_params=None):
+    """Append rows of new_cases to cases, aggregates of their dates are computed again."""
+    if countries_params is None:
+        return pd.concat([cases, new_cases], ignore_index=True).sort_values(by=['Place', 'Date'])
+    is_aggregate = cases['Place'].isin(aggregate_places(countries_params))
+    countries = pd.concat([cases[~is_aggregate], new_cases], ignore_index=True)
+    dates = new_cases['Date'].unique()
+    aggregates = add_aggregates(countries[countries['Date'].isin(dates)], countries_params)
+    aggregates = aggregates[aggregates['Place'].isin(aggregate_places(countries_params))]
+    kept = cases[is_aggregate & ~cases['Date'].isin(dates)]
+    return pd.concat([countries.sort_values(by=['Place', 'Date']),
+                      pd.concat([kept, aggregates]).sort_values(by=['Place', 'Date'])],
+                     ignore_index=True)
+
+
+def refresh_snapshot(covid_data_path, cases_file, cases_today_file, snapshot_path, countries_params=None):
+    """Bring the snapshot up to date with the CSV files, return (cases, cases_today, mode).
+
+    mode is 'unchanged' for a fresh snapshot, 'appended' if only rows of new
+    days were added to the cases file and 'rebuilt' otherwise. When the
+    ingested part of the file is unchanged only its tail is parsed, else the
+    whole file is parsed and checksums of date blocks tell if earlier days
+    were revised.
+    """
+    snapshot = load_snapshot(snapshot_path, covid_data_path, cases_file, cases_today_file)
+    if snapshot is not None:
+        return prepare_tables(*snapshot, countries_params) + ('unchanged',)
+
+    cases_path = os.path.join(covid_data_path, cases_file)
+    cases_today = parse_cases_today(os.path.join(covid_data_path, cases_today_file))
+    if countries_params is not None:
+        cases_today = add_aggregates(cases_today, countries_params, single_date=True)
+
+    path, meta = read_current_meta(snapshot_path)
+    ingest = meta.get('ingest') if meta is not None else None
+    cases = None
+    if ingest is not None:
+        old_cases = load_table(path, 'cases', meta['places'])
+        tail = read_tail(cases_path, ingest['size'], ingest['md5']) if ingest['md5'] else None
+        if tail is not None:
+            header, tail, md5 = tail
+            new_cases = parse_cases(io.BytesIO(header + tail))
+            # rows of already ingested days of a place are revisions
+            known_until = pd.to_datetime(new_cases['Place'].map(ingest['last_dates']))
+            if not (new_cases['Date'] <= known_until).any():
+                cases = append_cases(old_cases, new_cases, countries_params)
+                ingest = {'size': ingest['size'] + len(tail), 'md5': md5,
+                          'last_dates': {**ingest['last_dates'], **last_dates(new_cases)},
+                          'blocks': merge_blocks(ingest['blocks'], date_blocks(new_cases))}
+                mode = 'appended'
+
+    if cases is None:
+        size = os.path.getsize(cases_path)
+        all_cases = parse_cases(cases_path)
+        blocks = date_blocks(all_cases)
+        if ingest is not None and all(blocks.get(date) == checksum
+                                      for date, checksum in ingest['blocks'].items()):
+            new_cases = all_cases[~all_cases['Date'].dt.strftime('%Y-%m-%d').isin(ingest['blocks'])]
+            cases = append_cases(old_cases, new_cases, countries_params)
+            mode = 'appended'
+        else:
+            cases = all_cases
+            if countries_params is not None:
+                cases = add_aggregates(cases, countries_params)
+            mode = 'rebuilt'
+        ingest = {'size': size, 'md5': file_md5(cases_path, size),
+                  'last_dates': last_dates(all_cases), 'blocks': blocks}
+
+    cases, cases_today = compact_tables(cases, cases_today, countries_params)
+    build_snapshot(cases, cases_today, snapshot_path, covid_data_path, cases_file, cases_today_file,
+                   ingest)
+    return cases, cases_today, mode
+
+
+def preprocess(args, covid_data_path, cases_file, cases_today_file,
+               snapshot_path=None, update_snapshot=False, countries_params=None):
+    if snapshot_path and update_snapshot:
+        cases, cases_today, mode = refresh_snapshot(covid_data_path, cases_file, cases_today_file,
+                                                    snapshot_path, countries_params)
+        if mode != 'unchanged':
+            print('Data snapshot', mode, file=sys.stderr)
+        return cases, cases_today
+
+    # the columnar snapshot is used while it is fresh, CSV files otherwise
+    if snapshot_path:
+        snapshot = load_snapshot(snapshot_path, covid_data_path, cases_file, cases_today_file)
+        if snapshot is not None:
+            return prepare_tables(*snapshot, countries_params)
+
+    return prepare_tables(*read_cases(covid_data_path, cases_file, cases_today_file), countries_params)
+
+
+def add_daily(cases):
+    # rows of every place go in chronological order, so one grouped diff
+    # replaces the per-region masks; the first day keeps the total value
+    daily = cases.groupby('Place', sort=False, observed=True)[['Confirmed', 'Deaths']].diff()
+    cases['Confirmed_daily'] = daily['Confirmed'].fillna(cases['Confirmed']).astype(np.float32)
+    cases['Deaths_daily'] = daily['Deaths'].fillna(cases['Deaths']).astype(np.float32)
+    return cases
+
+
+def split_regions(args, cases, cases_today, countries_params, regions):
+    """Return per-region frames with daily values and populations of the regions."""
+    # drop places which are not selected, only the selected rows are copied
+    selected = [cases[cases['Place'].isin(regions)]]
+    if args.current_day or args.forec_current_day:
+        selected.append(cases_today[cases_today['Place'].isin(regions)])
+    cases = pd.concat(selected, ignore_index=True)
 
-    cases_today_raw = pd.read_csv(os.path.join(covid_data_path, cases_today_file))
-    # remove USA states
-    cases_today_raw = cases_today_raw[cases_today_raw['UID'] != 840]
-    cases_today = pd.DataFrame(cases_today_raw[useful_columns])
-    cases_today.rename(columns=rename_dict, inplace=True)
-    cases_today['Date'] = pd.to_datetime(cases_today['Date']) - np.timedelta64(1, 'D')
-    cases_today = cases_today.groupby(['Date', 'Place']).sum().reset_index()
-    cases_today = cases_today.sort_values(by=['Place', 'Date'])
+    add_daily(cases)
+
+    # cases.to_csv('cases_tmp.csv', index=False)
+
+    populations = {}
+    for region in regions:
+        populations[region] = countries_params[region]['population']
+    if args.nonabs:
+        population = cases['Place'].map(populations).astype(float)
+        cases[['Confirmed', 'Deaths']] = \
+            cases[['Confirmed', 'Deaths']].div(population, axis=0).astype(np.float32)
 
-    return cases, cases_today
+    # split the frame once, plotting and forecasts use per-region frames
+    region_cases = dict(tuple(cases.groupby('Place', sort=False, observed=True)))
+    return region_cases, populations
 
 
 def process(args, cases, cases_today, countries_params,
-            plot_file_name=False, use_agg=False):
-    if 'World' in set(args.regions):
-        world = cases.groupby(['Date']).sum()
-        world['Place'] = 'World'
-        world['Date'] = world.index
-        cases = cases.append(world, ignore_index=True, sort=True)
-
+            plot_file_name=False, use_agg=False, forecast_store=None, forecast_jobs=1):
+    """Draw the chosen regions, return the (region, field) pairs of the forecasts which failed."""
     regions_all = sorted(set(cases['Place'].values.tolist()))
     regions = sorted(list(set(regions_all) & set(args.regions)))
 
     if len(regions) == 0:
-        print('No known regions were specified. Should be in ', file=sys.stderr)
-        print(regions_all, file=sys.stderr)
-        sys.exit(-1)
+        raise NoRegionsError('No known regions were specified. Should be in \n' + str(regions_all))
 
     if args.list:
-        print(['World'])
         print(regions_all)
         sys.exit(0)
 
-    if args.current_day or args.forec_current_day:
-        cases = cases.append(cases_today, ignore_index=True, sort=True)
+    region_cases, populations, predictions, failed = compute_regions(args, cases, cases_today,
+                                                                     countries_params, regions,
+                                                                     forecast_store, forecast_jobs)
 
-    # drop places which are not selected
-    cases = pd.DataFrame(cases[cases['Place'].isin(regions)])
+    if use_agg and plot_file_name:
+        # imported here, plot_renderer uses this module
+        from plot_renderer import render_plot
+        render_plot(args, regions, region_cases, predictions, countries_params, plot_file_name)
+        return failed
 
-    for region in regions:
-        cases.loc[cases['Place'] == region, 'Confirmed_daily'] = \
-            cases.loc[cases['Place'] == region, 'Confirmed'].diff()
-        cases.loc[cases['Place'] == region, 'Deaths_daily'] = \
-            cases.loc[cases['Place'] == region, 'Deaths'].diff()
+    if use_agg:
+        plt.switch_backend('Agg')
 
-    cases['Confirmed_daily'].fillna(cases['Confirmed'], inplace=True)
-    cases['Deaths_daily'].fillna(cases['Deaths'], inplace=True)
+    draw_plot(args, regions, region_cases, populations, predictions, countries_params, plot_file_name)
+    return failed
 
-    # cases.to_csv('cases_tmp.csv', index=False)
 
-    populations = {}
-    for region in regions:
-        populations[region] = countries_params[region]['population']
-    if args.nonabs:
-        for region in regions:
-            cases.loc[cases['Place'] == region, ['Confirmed', 'Deaths']] = \
-                cases.loc[cases['Place'] == region, ['Confirmed', 'Deaths']] / populations[region]
+def compute_regions(args, cases, cases_today, countries_params, regions, forecast_store=None,
+                    forecast_jobs=1):
+    """Return per-region frames, populations, predictions by (region, field) and the failed ones, see process.
 
-    if use_agg:
-        plt.switch_backend('Agg')
+    Failed forecasts are None in predictions and are not drawn.
+    """
+    region_cases, populations = split_regions(args, cases, cases_today, countries_params, regions)
 
+    # forecasts of all the regions are computed before drawing, failed ones are not drawn
+    jobs = []
+    for region in regions:
+        if args.forec_confirmed:
+            jobs.append((args.forec_confirmed, region, 'Confirmed'))
+        if args.forec_deaths:
+            jobs.append((args.forec_deaths, region, 'Deaths'))
+    for forec_args, _, _ in jobs:
+        check_forecast_method(forec_args)
+    predictions = dict(zip([(region, field_name) for _, region, field_name in jobs],
+                           forecast_all(jobs, region_cases, populations,
+                                        args.forec_current_day, args.nonabs,
+                                        store=forecast_store, n_jobs=forecast_jobs,
+                                        raise_errors=False)))
+    failed = [region_field for region_field, prediction in predictions.items() if prediction is None]
+    return region_cases, populations, predictions, failed
+
+
+def draw_plot(args, regions, region_cases, populations, predictions, countries_params, plot_file_name):
+    """Draw the regions and their forecasts with pyplot, show the plot unless plot_file_name is given."""
     fig, ax1 = plt.subplots()
     plt.title('Подтвержденные (—)')
     if args.daily:
@@ -231,39 +683,37 @@ def process(args, cases, cases_today, countries_params,
 
         color = next(ax1._get_lines.prop_cycler)['color']
 
-        cases[cases['Place'] == region].plot(x='Date', y='Confirmed', linestyle='-',
-                                             lw=2.1,
-                                             color=color, ax=ax1, marker='o',
-                                             markersize=2.7,
-                                             label=countries_params[region]['country_ru'])
+        region_cases[region].plot(x='Date', y='Confirmed', linestyle='-', lw=2.1,
+                                  color=color, ax=ax1, marker='o', markersize=2.7,
+                                  label=countries_params[region]['country_ru'])
 
         if args.daily:
-            ax2 = cases[cases['Place'] == region].plot(x='Date', y='Confirmed_daily',
-                                                       linestyle='-',
-                                                       secondary_y=True,
-                                                       lw=0.3,
-                                                       color=color, ax=ax1, marker='s',
-                                                       markersize=4)
+            ax2 = region_cases[region].plot(x='Date', y='Confirmed_daily',
+                                            linestyle='-', secondary_y=True, lw=0.3,
+                                            color=color, ax=ax1, marker='s',
+                                            markersize=4)
 
         if args.deaths or args.forec_deaths:
-            cases[cases['Place'] == region].plot(x='Date', y='Deaths',
-                                                 linestyle='--', lw=2.1, color=color,
-                                                 ax=ax1, label='', marker=2,
-                                                 markersize=3.5)
+            region_cases[region].plot(x='Date', y='Deaths',
+                                      linestyle='--', lw=2.1, color=color,
+                                      ax=ax1, label='', marker=2,
+                                      markersize=3.5)
 
         # forecast and plot confirmed cases
-        if args.forec_confirmed:
-            forecast(args.forec_confirmed, cases[cases['Place'] == region],
+        if args.forec_confirmed and predictions[region, 'Confirmed'] is not None:
+            forecast(args.forec_confirmed, region_cases[region],
                      field_name='Confirmed', ax=ax1, color=color,
                      forec_current_day=args.forec_current_day, isDaily=args.daily,
-                     nonabs=args.nonabs, population=populations[region])
+                     nonabs=args.nonabs, population=populations[region],
+                     prediction_df=predictions[region, 'Confirmed'])
 
         # forecast and plot deaths
-        if args.forec_deaths:
-            forecast(args.forec_deaths, cases[cases['Place'] == region],
+        if args.forec_deaths and predictions[region, 'Deaths'] is not None:
+            forecast(args.forec_deaths, region_cases[region],
                      field_name='Deaths', ax=ax1, color=color,
                      forec_current_day=args.forec_current_day, isDaily=args.daily,
-                     nonabs=args.nonabs, population=populations[region])
+                     nonabs=args.nonabs, population=populations[region],
+                     prediction_df=predictions[region, 'Deaths'])
 
     legend = ax1.legend()
     for handle in legend.legendHandles:
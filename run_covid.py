@@ -1,16 +1,33 @@
 #!/usr/bin/env python3
 # coding: utf-8
 
-import sys
-from flask import Flask, url_for, send_from_directory
+import posixpath
+from flask import Flask, url_for, send_from_directory, abort
 from covid_web import *
 
-covid_app = Flask(__name__, static_folder='data')
+# files of data/ are served by sendfile
+covid_app = Flask(__name__, static_folder=None)
+
+# a year, the longest max-age understood by caches
+immutable_max_age = 365 * 24 * 60 * 60
+
+# the only public files of data/, other files are not served
+public_dirs = {plots_dir, 'js'}
+public_files = {'countries_params.json'}
 
 
 @covid_app.route('/data/<path:query>')
 def sendfile(query):
-    print('Yes we are', file=sys.stderr)
+    directory, file_name = posixpath.split(query)
+    if directory not in public_dirs and query not in public_files:
+        abort(404)
+    if directory == plots_dir and file_name.endswith(plot_cache.suffix):
+        # plot files are named by their render key and never change
+        key = file_name[:-len(plot_cache.suffix)]
+        response = send_from_directory('data/', query, etag=key, max_age=immutable_max_age)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
     return send_from_directory('data/', query)
 
 
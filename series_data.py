@@ -0,0 +1,74 @@
+import hashlib
+import json
+import math
+
+import numpy as np
+
+from plot_cache import normalize_forecast
+
+# Series of the regions for the charts drawn by the browser: dates are day
+# offsets from the `start` date, totals are whole numbers of people or
+# shares of the population rounded to 6 significant digits, daily values
+# are numbers of people. Forecasts have their own day offsets.
+
+
+def series_params(args):
+    """Parameters which change the series, plot options are applied by the browser."""
+    return {'regions': sorted(set(args.regions)),
+            'nonabs': bool(args.nonabs),
+            'current_day': bool(args.current_day),
+            'forec_current_day': bool(args.forec_current_day),
+            'forec_confirmed': normalize_forecast(args.forec_confirmed),
+            'forec_deaths': normalize_forecast(args.forec_deaths)}
+
+
+def series_etag(args, data_version):
+    params = json.dumps([series_params(args), data_version], sort_keys=True)
+    return hashlib.md5(params.encode('ascii', 'backslashreplace')).hexdigest()
+
+
+def compact_values(values, relative=False):
+    result = []
+    for value in np.asarray(values, dtype=float).tolist():
+        if not math.isfinite(value):
+            result.append(None)
+        elif relative:
+            result.append(float('%.6g' % value))
+        else:
+            result.append(int(round(value)))
+    return result
+
+
+def day_offsets(dates, start):
+    return ((np.asarray(dates, dtype='datetime64[D]') - start) // np.timedelta64(1, 'D')).tolist()
+
+
+def forecast_series(forec_args, prediction_df, field_name, start, nonabs):
+    series = {'method': forec_args[0],
+              'days': day_offsets(prediction_df.index.to_numpy(), start),
+              'values': compact_values(prediction_df[field_name], nonabs)}
+    daily = field_name + '_daily'
+    if field_name == 'Confirmed' and daily in prediction_df:
+        series['daily'] = compact_values(prediction_df[daily])
+    return series
+
+
+def region_series(args, regions, region_cases, predictions, countries_params, data_version):
+    """Return the JSON payload of the regions computed by process_procedures.compute_regions."""
+    start = np.datetime64(min(region_cases[region]['Date'].min() for region in regions), 'D')
+    payload = {'version': data_version, 'start': str(start), 'nonabs': bool(args.nonabs), 'regions': []}
+    for region in regions:
+        df = region_cases[region]
+        series = {'place': region,
+                  'name': countries_params[region]['country_ru'],
+                  'days': day_offsets(df['Date'].to_numpy(), start),
+                  'confirmed': compact_values(df['Confirmed'], args.nonabs),
+                  'deaths': compact_values(df['Deaths'], args.nonabs),
+                  'confirmed_daily': compact_values(df['Confirmed_daily']),
+                  'forecasts': {}}
+        for forec_args, field_name in [(args.forec_confirmed, 'Confirmed'), (args.forec_deaths, 'Deaths')]:
+            if forec_args and predictions.get((region, field_name)) is not None:
+                series['forecasts'][field_name.lower()] = forecast_series(
+                    forec_args, predictions[region, field_name], field_name, start, args.nonabs)
+        payload['regions'].append(series)
+    return payload
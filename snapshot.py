@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+# Columnar snapshot of the preprocessed JHU tables. Date and Place of every
+# table are stored as separate .npy files and the counts as one
+# (count column, row) array, so they can be memory-mapped and only the
+# needed columns are read. `Place` is stored as int16 codes into
+# the `places` list of meta.json, the categories of the Place column.
+# meta.json also keeps mtime and size of the source CSV files and is
+# written last, after all the columns.
+# Its `ingest` entry describes the ingested cases file for incremental
+# refresh: the byte size and md5 of the ingested part, the last date of
+# every place and a checksum of the rows of every date.
+#
+# Every update is a new version directory v-<time> in the snapshot
+# directory and the `current` symlink is switched to it atomically. The
+# columns are stored in the dtypes of the loaded frames, so all processes
+# reading the snapshot share the pages of the mapped files instead of
+# keeping own copies. A few previous versions are kept for processes
+# which are still loading them.
+
+meta_file = 'meta.json'
+current_link = 'current'
+keep_versions = 3
+tables = ['cases', 'cases_today']
+count_columns = ['Confirmed', 'Deaths']
+
+
+def source_stats(covid_data_path, source_files):
+    stats = {}
+    for source_file in source_files:
+        stat = os.stat(os.path.join(covid_data_path, source_file))
+        stats[source_file] = [stat.st_mtime_ns, stat.st_size]
+    return stats
+
+
+def column_file(snapshot_path, table, column):
+    return os.path.join(snapshot_path, table + '.' + column + '.npy')
+
+
+def read_meta(snapshot_path):
+    try:
+        with open(os.path.join(snapshot_path, meta_file), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def current_path(snapshot_path):
+    """Directory of the current snapshot version or None."""
+    try:
+        return os.path.join(snapshot_path, os.readlink(os.path.join(snapshot_path, current_link)))
+    except OSError:
+        return None
+
+
+def read_current_meta(snapshot_path):
+    """Return (directory, meta) of the current version, meta is None without a snapshot."""
+    path = current_path(snapshot_path)
+    return path, read_meta(path) if path is not None else None
+
+
+def is_fresh(meta, covid_data_path, cases_file, cases_today_file):
+    if meta is None:
+        return False
+    try:
+        stats = source_stats(covid_data_path, [cases_file, cases_today_file])
+    except OSError:
+        return False
+    return meta['sources'] == stats
+
+
+def read_prefix(f, m, size):
+    # reads size bytes into the md5 m, False if the file is shorter
+    while size > 0:
+        chunk = f.read(min(size, 2 ** 20))
+        if not chunk:
+            return False
+        m.update(chunk)
+        size -= len(chunk)
+    return True
+
+
+def file_md5(file_path, size):
+    """md5 of the first size bytes of the file, None unless they end with a whole line."""
+    m = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        if not read_prefix(f, m, size - 1) or f.read(1) != b'\n':
+            return None
+    m.update(b'\n')
+    return m.hexdigest()
+
+
+def read_tail(file_path, size, md5):
+    """Return (header, tail, md5 of the file) if the first size bytes of the file have the given md5.
+
+    tail are the bytes after them; the md5 is None unless the file ends
+    with a whole line. Return None if the beginning of the file has changed.
+    """
+    m = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        f.seek(0)
+        if not read_prefix(f, m, size) or m.hexdigest() != md5:
+            return None
+        tail = f.read()
+    m.update(tail)
+    return header, tail, m.hexdigest() if tail.endswith(b'\n') or not tail else None
+
+
+def merge_blocks(blocks, new_blocks):
+    # checksums are sums of row hashes, so rows of a date can come in parts
+    merged = dict(blocks)
+    for date, checksum in new_blocks.items():
+        merged[date] = '%016x' % ((int(merged.get(date, '0'), 16) + int(checksum, 16)) % 2 ** 64)
+    return merged
+
+
+def date_blocks(cases):
+    """Checksum of the (Place, Confirmed, Deaths) rows of every date, independent of row order."""
+    if len(cases) == 0:
+        return {}
+    hashes = pd.util.hash_pandas_object(cases[['Place'] + count_columns], index=False).to_numpy()
+    dates = cases['Date'].to_numpy().astype('datetime64[D]')
+    order = np.argsort(dates, kind='stable')
+    dates = dates[order]
+    starts = np.flatnonzero(np.r_[True, dates[1:] != dates[:-1]])
+    sums = np.add.reduceat(hashes[order], starts)
+    return {str(date): '%016x' % checksum for date, checksum in zip(dates[starts], sums)}
+
+
+def last_dates(cases):
+    return {place: str(np.datetime64(date, 'D'))
+            for place, date in cases.groupby('Place')['Date'].max().items()}
+
+
+def build_snapshot(cases, cases_today, snapshot_path, covid_data_path, cases_file, cases_today_file,
+                   ingest=None):
+    stats = source_stats(covid_data_path, [cases_file, cases_today_file])
+    if isinstance(cases['Place'].dtype, pd.CategoricalDtype):
+        places = list(cases['Place'].cat.categories)
+    else:
+        places = sorted(set(cases['Place']) | set(cases_today['Place']))
+
+    # build in a temporary directory, it becomes the new version at the end
+    os.makedirs(snapshot_path, exist_ok=True)
+    for name in os.listdir(snapshot_path):
+        # files of the snapshot without versions
+        if name.endswith('.npy') or name == meta_file:
+            os.remove(os.path.join(snapshot_path, name))
+    tmp_path = os.path.join(snapshot_path, 'tmp-%d' % os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    for table, df in zip(tables, [cases, cases_today]):
+        date = df['Date'].to_numpy().astype('datetime64[ns]')
+        np.save(column_file(tmp_path, table, 'Date'), date)
+        place = pd.Categorical(df['Place'], categories=places).codes.astype(np.int16)
+        np.save(column_file(tmp_path, table, 'Place'), place)
+        # one array for all the counts, it becomes one block of the loaded frame
+        np.save(column_file(tmp_path, table, 'counts'), np.ascontiguousarray(df[count_columns].to_numpy().T))
+
+    with open(os.path.join(tmp_path, meta_file), 'w', encoding='utf-8') as f:
+        json.dump({'sources': stats, 'places': places, 'ingest': ingest}, f, ensure_ascii=False)
+
+    version = 'v-%016x' % time.time_ns()
+    os.rename(tmp_path, os.path.join(snapshot_path, version))
+    tmp_link = os.path.join(snapshot_path, 'tmp-%d-' % os.getpid() + current_link)
+    os.symlink(version, tmp_link)
+    os.replace(tmp_link, os.path.join(snapshot_path, current_link))
+
+    # readers which mapped an old version keep their pages after it is removed
+    versions = sorted(name for name in os.listdir(snapshot_path) if name.startswith('v-'))
+    for name in versions[:-keep_versions]:
+        shutil.rmtree(os.path.join(snapshot_path, name), ignore_errors=True)
+
+
+def load_table(snapshot_path, table, places, columns=None):
+    if columns is None:
+        columns = ['Date', 'Place'] + count_columns
+    # columns stay read-only views of the mapped files: pandas does not
+    # consolidate frames with one block per dtype, which would copy them
+    frames = []
+    for column in columns:
+        if column in count_columns:
+            continue
+        values = np.load(column_file(snapshot_path, table, column), mmap_mode='r')
+        if column == 'Place':
+            values = pd.Categorical.from_codes(values, places)
+        frames.append(pd.DataFrame({column: values}, copy=False))
+    counts = [column for column in count_columns if column in columns]
+    if counts:
+        values = np.load(column_file(snapshot_path, table, 'counts'), mmap_mode='r')
+        if len(counts) < len(count_columns):
+            values = values[[count_columns.index(column) for column in counts]]
+        frames.append(pd.DataFrame(values.T, columns=counts, copy=False))
+    # the counts come after the other columns
+    return pd.concat(frames, axis=1, copy=False) if len(frames) > 1 else frames[0]
+
+
+def load_snapshot(snapshot_path, covid_data_path, cases_file, cases_today_file, columns=None):
+    """Return (cases, cases_today) from the snapshot or None if it is missing or stale."""
+    path, meta = read_current_meta(snapshot_path)
+    if not is_fresh(meta, covid_data_path, cases_file, cases_today_file):
+        return None
+    try:
+        return tuple(load_table(path, table, meta['places'], columns) for table in tables)
+    except FileNotFoundError:
+        # the version was removed by newer updates meanwhile
+        return load_snapshot(snapshot_path, covid_data_path, cases_file, cases_today_file, columns)
+
+
+def load_current(snapshot_path, columns=None):
+    """Return (version, cases, cases_today) of the current version, fresh or not, or None."""
+    path, meta = read_current_meta(snapshot_path)
+    if meta is None:
+        return None
+    try:
+        return (os.path.basename(path),) + tuple(load_table(path, table, meta['places'], columns)
+                                                 for table in tables)
+    except FileNotFoundError:
+        return load_current(snapshot_path, columns)
+
+
+def snapshot_places(snapshot_path, covid_data_path, cases_file, cases_today_file):
+    """Return the list of places with data from a fresh snapshot or None."""
+    path, meta = read_current_meta(snapshot_path)
+    if not is_fresh(meta, covid_data_path, cases_file, cases_today_file):
+        return None
+    codes = np.unique(np.concatenate([np.load(column_file(path, table, 'Place'), mmap_mode='r')
+                                      for table in tables]))
+    return [meta['places'][code] for code in codes]
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Renders the most popular charts of the web service into its plot and
+# forecast caches, so the first users after the data update do not wait:
+# python3 warm_cache.py --access_log /var/log/nginx/access.log --top 50
+# Run it after python3 covid_plot.py --precompute. Charts are read from
+# chart URLs of the access log, from a file with one chart URL or query per
+# line, or the default charts below are rendered.
+
+import argparse
+import re
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from werkzeug.datastructures import MultiDict
+
+from covid_web import query_chart, chart_args, chart_query, render_chart, cases_cache
+
+# countries of the default charts, with the default values of the form
+default_charts = [['World'], ['Russia'], ['Russia', 'World']]
+default_query = [('log', '1'), ('daily', '1'), ('deaths', '1'), ('from_date', '2020-03-01')]
+
+# request line of the common and combined log formats
+request_re = re.compile(r'"GET (\S+) HTTP/[\d.]+"')
+
+
+def chart_queries(lines):
+    """Chart queries of chart URLs or bare queries, other lines are skipped.
+
+    Charts are pages of the root of the service, e.g. /covid/?country=Russia,
+    requests of other paths such as /covid/api/series are not charts.
+    """
+    for line in lines:
+        match = request_re.search(line)
+        url = match.group(1) if match else line.strip()
+        if '?' in url:
+            parts = urlsplit(url)
+            if parts.path and not parts.path.endswith('/'):
+                continue
+            query = parts.query
+        else:
+            query = url
+        if 'country=' in query:
+            yield query
+
+
+def top_charts(queries, top):
+    """Arguments of the top charts, spellings of one chart are counted together."""
+    counts = Counter()
+    charts = {}
+    for query in queries:
+        params = MultiDict(parse_qsl(query, keep_blank_values=True))
+        # charts of the browser mode are not rendered by the service
+        if params.get('client'):
+            continue
+        try:
+            args = chart_args(query_chart(params))
+        except ValueError:
+            continue
+        canonical = urlencode(chart_query(args, False), safe=',')
+        counts[canonical] += 1
+        charts[canonical] = args
+    return [(canonical, charts[canonical]) for canonical, _ in counts.most_common(top)]
+
+
+def warm_chart(canonical, args):
+    start = time.time()
+    try:
+        _, rendered, failed = render_chart(args)
+        status = 'rendered' if rendered else 'cached'
+        if failed:
+            status = 'failed: forecasts of %s' % ', '.join('%s %s' % region_field for region_field in failed)
+    except Exception as e:
+        status = 'failed: %s' % e
+    return canonical, status, time.time() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render popular charts into the caches of the web service',
+                                     prog='warm_cache')
+    parser.add_argument('--access_log', nargs='*', default=[],
+                        help='read chart URLs from access logs')
+    parser.add_argument('--configs', default=None,
+                        help='read chart URLs or queries from a file, one per line')
+    parser.add_argument('--top', type=int, default=50,
+                        help='set number of the most requested charts to render')
+    parser.add_argument('--jobs', type=int, default=2,
+                        help='set number of charts rendered at the same time')
+    args = parser.parse_args()
+
+    lines = []
+    for file_name in args.access_log + ([args.configs] if args.configs else []):
+        try:
+            with open(file_name, 'r', encoding='utf-8', errors='replace') as f:
+                lines.extend(f)
+        except OSError as e:
+            print(e, file=sys.stderr)
+            sys.exit(-1)
+    if not args.access_log and not args.configs:
+        lines = [urlencode([('country', country) for country in countries] + default_query)
+                 for countries in default_charts]
+
+    start = time.time()
+    charts = top_charts(chart_queries(lines), args.top)
+    if not charts:
+        print('No charts found', file=sys.stderr)
+        sys.exit(-1)
+    # the tables are loaded once, before the charts
+    load_start = time.time()
+    cases_cache.get()
+    print('%d charts, data loaded in %.1f s' % (len(charts), time.time() - load_start), file=sys.stderr)
+
+    with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+        results = list(pool.map(lambda chart: warm_chart(*chart), charts))
+
+    for canonical, status, elapsed in results:
+        print('%8.2f s  %-8s  ?%s' % (elapsed, status, canonical))
+    rendered = sum(status == 'rendered' for _, status, _ in results)
+    failed = sum(status.startswith('failed') for _, status, _ in results)
+    print('%d charts in %.1f s: %d rendered, %d cached, %d failed'
+          % (len(results), time.time() - start, rendered, len(results) - rendered - failed, failed))
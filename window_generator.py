@@ -0,0 +1,128 @@
+import matplotlib.pyplot as plt
+import numpy as np
+import tensorflow as tf
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class WindowGenerator:
+    batch_size = 64
+
+    def __init__(self, input_width, label_width, shift,
+                 train_df, val_df, test_df, label_columns=None):
+        self.train_df = train_df
+        self.val_df = val_df
+        self.test_df = test_df
+        self.label_columns = label_columns
+        if label_columns is not None:
+            self.label_columns_indices = {name: i for i, name in enumerate(label_columns)}
+        self.column_indices = {name: i for i, name in enumerate(train_df.columns)}
+        self.input_width = input_width
+        self.label_width = label_width
+        self.shift = shift
+        self.total_window_size = input_width + shift
+        self.input_slice = slice(0, input_width)
+        self.input_indices = np.arange(self.total_window_size)[self.input_slice]
+        self.label_start = self.total_window_size - self.label_width
+        self.labels_slice = slice(self.label_start, None)
+        self.label_indices = np.arange(self.total_window_size)[self.labels_slice]
+        # datasets built on first access
+        self._datasets = {}
+
+    def make_windows(self, data):
+        """Return inputs and labels of all the windows of data as [window, time, feature] arrays."""
+        data = np.asarray(data, dtype=np.float32)
+        if len(data) < self.total_window_size:
+            windows = np.empty((0, self.total_window_size, data.shape[1]), dtype=np.float32)
+        else:
+            # strided view of data, nothing is copied until tensorflow takes the slices
+            windows = sliding_window_view(data, self.total_window_size, axis=0).transpose(0, 2, 1)
+        inputs = windows[:, self.input_slice, :]
+        labels = windows[:, self.labels_slice, :]
+        if self.label_columns is not None:
+            labels = labels[:, :, [self.column_indices[name] for name in self.label_columns]]
+        return inputs, labels
+
+    def plot(self, model=None, plot_col='Confirmed_daily', max_subplots=7):
+        inputs, labels = self.example
+        plt.figure(figsize=(12, 18))
+        plot_col_index = self.column_indices[plot_col]
+        max_n = min(max_subplots, len(inputs))
+        for n in range(max_n):
+            plt.subplot(max_n, 1, n + 1)
+            plt.ylabel(f'{plot_col} [normed]')
+            plt.plot(self.input_indices, inputs[n, :, plot_col_index], label='Inputs', marker='.', zorder=-10)
+            if self.label_columns:
+                label_col_index = self.label_columns_indices.get(plot_col, None)
+            else:
+                label_col_index = plot_col_index
+            if label_col_index is None:
+                continue
+            plt.scatter(self.label_indices, labels[n, :, label_col_index],
+                        edgecolors='k', label='Labels', c='#2ca02c', s=64)
+            if model is not None:
+                predictions = model(inputs)
+                plt.scatter(self.label_indices, predictions[n, :, label_col_index],
+                            marker='X', edgecolors='k', label='Predictions', c='#ff7f0e', s=64)
+            if n == 0:
+                plt.legend()
+        plt.xlabel('Time [d]')
+
+    def make_dataset(self, data, shuffle=True):
+        inputs, labels = self.make_windows(data)
+        ds = tf.data.Dataset.from_tensor_slices((inputs, labels)).cache()
+        if shuffle and len(inputs):
+            ds = ds.shuffle(len(inputs))
+        return ds.batch(self.batch_size).prefetch(tf.data.AUTOTUNE)
+
+    def dataset(self, name, data, shuffle=True):
+        # windows are built once, model.fit iterates over the same dataset every epoch
+        ds = self._datasets.get(name)
+        if ds is None:
+            ds = self._datasets[name] = self.make_dataset(data, shuffle)
+        return ds
+
+    @property
+    def train(self):
+        return self.dataset('train', self.train_df)
+
+    @property
+    def val(self):
+        return self.dataset('val', self.val_df, shuffle=False)
+
+    @property
+    def test(self):
+        return self.dataset('test', self.test_df, shuffle=False)
+
+    @property
+    def example(self):
+        """Get and cache an example batch of `inputs, labels` for plotting."""
+        result = getattr(self, '_example', None)
+        if result is None:
+            result = next(iter(self.train))
+            self._example = result
+        return result
+
+
+def compile_and_fit(model, window, patience=2):
+    early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss',
+                                                      patience=patience,
+                                                      mode='min')
+
+    model.compile(loss=tf.losses.MeanSquaredError(),
+                  optimizer=tf.optimizers.Adam(),
+                  metrics=[tf.metrics.MeanAbsoluteError()])
+
+    history = model.fit(window.train, epochs=100,
+                        validation_data=window.val,
+                        callbacks=[early_stopping])
+
+    return history
+
+
+def fit_window_model(create_model, train_df, val_df, test_df, IN_STEPS, OUT_STEPS):
+    num_features = train_df.shape[1]
+    window = WindowGenerator(IN_STEPS, OUT_STEPS, OUT_STEPS,
+                             train_df, val_df, test_df)
+    model = create_model(num_features, OUT_STEPS)
+    history = compile_and_fit(model, window)
+    return model, window